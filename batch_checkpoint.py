@@ -0,0 +1,161 @@
+"""
+batch_checkpoint.py
+-------------------
+Durable progress for batch report runs, so a crashed run resumes instead of
+starting over.
+✅ Every finished student report is recorded the moment Gemini returns it
+✅ Every finished parent is recorded after its output file is written
+✅ A rerun with the same run id skips finished parents and reuses finished
+   students — only the unfinished work costs Gemini calls
+✅ Output files written atomically (temp file + rename), so reruns replace
+   them instead of leaving half-written files
+✅ Local SQLite file (WAL), safe for the batch's worker threads
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# ======================================================
+# ✅ CHECKPOINT CONFIG
+# ======================================================
+BATCH_CHECKPOINT_DB = os.getenv("BATCH_CHECKPOINT_DB", "batch_checkpoints.sqlite3")
+BATCH_CHECKPOINT_RETENTION_DAYS = float(os.getenv("BATCH_CHECKPOINT_RETENTION_DAYS", "30"))
+
+
+def write_atomic(path, text):
+    """
+    Write via a temp file + rename, so a crash never leaves half a report
+    and a rerun simply replaces the file.
+    """
+    tmp = f"{path}.tmp{os.getpid()}.{threading.get_ident()}"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+
+def _placeholders(values):
+    return ", ".join("?" for _ in values)
+
+
+class CheckpointStore:
+    """
+    Per-run completion records, keyed by a run id such as the report week.
+    """
+
+    def __init__(self, path=BATCH_CHECKPOINT_DB):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS batch_students (
+                run_id TEXT NOT NULL,
+                phone TEXT NOT NULL,
+                username TEXT NOT NULL,
+                report TEXT NOT NULL,
+                completed_at REAL NOT NULL,
+                PRIMARY KEY (run_id, phone, username)
+            )
+        """)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS batch_parents (
+                run_id TEXT NOT NULL,
+                phone TEXT NOT NULL,
+                status TEXT NOT NULL,
+                output TEXT,
+                completed_at REAL NOT NULL,
+                PRIMARY KEY (run_id, phone)
+            )
+        """)
+        self._conn.commit()
+
+    # ---------- students ----------
+    def record_student(self, run_id, phone, username, report):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO batch_students (run_id, phone, username, report, completed_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (run_id, phone, username, report, time.time()),
+            )
+            self._conn.commit()
+
+    def student_reports(self, run_id, phones):
+        """
+        Finished student reports for these phones: {phone: {username: report}}.
+        """
+        phones = list(phones)
+        if not phones:
+            return {}
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT phone, username, report FROM batch_students "
+                f"WHERE run_id = ? AND phone IN ({_placeholders(phones)})",
+                (run_id, *phones),
+            ).fetchall()
+        completed = {}
+        for phone, username, report in rows:
+            completed.setdefault(phone, {})[username] = report
+        return completed
+
+    # ---------- parents ----------
+    def record_parent(self, run_id, phone, status, output=None):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO batch_parents (run_id, phone, status, output, completed_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (run_id, phone, status, output, time.time()),
+            )
+            self._conn.commit()
+
+    def finished_parents(self, run_id, phones):
+        """
+        Parents already finished in this run whose output (if any) still
+        exists: {phone: status}. A deleted output file counts as unfinished;
+        its students' reports are still reused.
+        """
+        phones = list(phones)
+        if not phones:
+            return {}
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT phone, status, output FROM batch_parents "
+                f"WHERE run_id = ? AND phone IN ({_placeholders(phones)})",
+                (run_id, *phones),
+            ).fetchall()
+        return {
+            phone: status for phone, status, output in rows
+            if output is None or os.path.exists(output)
+        }
+
+    # ---------- runs ----------
+    def counts(self, run_id):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT status, COUNT(*) FROM batch_parents WHERE run_id = ? GROUP BY status",
+                (run_id,),
+            ).fetchall()
+        return Counter(dict(rows))
+
+    def clear(self, run_id):
+        """
+        Forget a run, so the next run with this id starts from scratch.
+        """
+        with self._lock:
+            self._conn.execute("DELETE FROM batch_students WHERE run_id = ?", (run_id,))
+            self._conn.execute("DELETE FROM batch_parents WHERE run_id = ?", (run_id,))
+            self._conn.commit()
+
+    def prune(self, retention_days=BATCH_CHECKPOINT_RETENTION_DAYS):
+        """
+        Drop records older than the retention period.
+        """
+        cutoff = time.time() - retention_days * 86400
+        with self._lock:
+            self._conn.execute("DELETE FROM batch_students WHERE completed_at < ?", (cutoff,))
+            self._conn.execute("DELETE FROM batch_parents WHERE completed_at < ?", (cutoff,))
+            self._conn.commit()
@@ -0,0 +1,191 @@
+"""
+batch_leases.py
+---------------
+Shard leases that let several weekly_batch.py nodes share one run.
+✅ Parents are split into shards by a hash of their phone (same hash in
+   Python and in Postgres)
+✅ Nodes claim shards from batch_shard_leases (FOR UPDATE SKIP LOCKED) —
+   no coordinator, no node count to configure
+✅ A heartbeat extends the lease and saves the shard's progress; a crashed
+   node's lease expires and another node resumes its shard from there
+✅ Postgres only — the table is created by `python migrations.py migrate`
+"""
+
+import hashlib
+import os
+import socket
+from datetime import timedelta
+from dotenv import load_dotenv
+from sqlalchemy import select, update, func, and_, or_, cast, literal_column, Integer
+from sqlalchemy.dialects.postgresql import BIT, insert
+
+from tables import batch_leases_table
+
+load_dotenv()
+
+# ======================================================
+# ✅ LEASE CONFIG
+# ======================================================
+BATCH_SHARDS = int(os.getenv("BATCH_SHARDS", "64"))
+BATCH_LEASE_SECONDS = int(os.getenv("BATCH_LEASE_SECONDS", "120"))
+
+
+# ======================================================
+# ✅ SHARDING
+# ======================================================
+def shard_of(phone, shard_count):
+    """
+    Shard of a phone: the first 28 bits of its md5, modulo shard_count.
+    """
+    return int(hashlib.md5(phone.encode("utf-8")).hexdigest()[:7], 16) % shard_count
+
+
+def shard_expr(column, shard_count):
+    """
+    shard_of() as a Postgres expression (28 bits, so the int stays positive).
+    """
+    hex_prefix = literal_column("'x'").concat(func.substr(func.md5(column), 1, 7))
+    return func.mod(cast(cast(hex_prefix, BIT(28)), Integer), shard_count)
+
+
+# ======================================================
+# ✅ LEASES
+# ======================================================
+class ShardLeases:
+    """
+    One node's view of a run's shards. `owner` identifies the node
+    (host:pid by default); only the owner can extend or finish its lease.
+    """
+
+    def __init__(self, engine, run_id, shard_count=BATCH_SHARDS, owner=None,
+                 lease_seconds=BATCH_LEASE_SECONDS):
+        self.engine = engine
+        self.run_id = run_id
+        self.shard_count = shard_count
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}"
+        self.lease_seconds = lease_seconds
+
+    def _lease_until(self):
+        return func.now() + timedelta(seconds=self.lease_seconds)
+
+    def ensure(self):
+        """
+        Create the run's shard rows (first node wins; the rest no-op), and
+        put failed shards back to pending so this run retries them.
+
+        Raises:
+            ValueError: if the run was started with a different shard count
+        """
+        lt = batch_leases_table
+        with self.engine.begin() as conn:
+            conn.execute(
+                insert(lt)
+                .values([
+                    {"run_id": self.run_id, "shard": shard, "shard_count": self.shard_count,
+                     "status": "pending", "attempts": 0}
+                    for shard in range(self.shard_count)
+                ])
+                .on_conflict_do_nothing()
+            )
+            conn.execute(
+                update(lt)
+                .where(lt.c.run_id == self.run_id, lt.c.status == "failed")
+                .values(status="pending", updated_at=func.now())
+            )
+            counts = conn.execute(
+                select(lt.c.shard_count).where(lt.c.run_id == self.run_id).distinct()
+            ).scalars().all()
+        if counts != [self.shard_count]:
+            raise ValueError(f"Run {self.run_id} uses {counts} shards, not {self.shard_count}")
+
+    def claim(self):
+        """
+        Lease the next pending shard, or one whose lease has expired.
+
+        Returns:
+            (shard, progress_phone), or None when nothing is claimable
+        """
+        lt = batch_leases_table
+        candidate = (
+            select(lt.c.shard)
+            .where(
+                lt.c.run_id == self.run_id,
+                or_(
+                    lt.c.status == "pending",
+                    and_(lt.c.status == "leased", lt.c.lease_expires_at < func.now()),
+                ),
+            )
+            .order_by(lt.c.shard)
+            .limit(1)
+            .with_for_update(skip_locked=True)
+            .scalar_subquery()
+        )
+        with self.engine.begin() as conn:
+            row = conn.execute(
+                update(lt)
+                .where(lt.c.run_id == self.run_id, lt.c.shard == candidate)
+                .values(status="leased", owner=self.owner, lease_expires_at=self._lease_until(),
+                        attempts=lt.c.attempts + 1, updated_at=func.now())
+                .returning(lt.c.shard, lt.c.progress_phone, lt.c.attempts)
+            ).first()
+        if row is None:
+            return None
+        if row.attempts > 1:
+            print(f"♻️  Took over shard {row.shard} (attempt {row.attempts}), resuming after {row.progress_phone!r}")
+        return row.shard, row.progress_phone
+
+    def _update_own(self, shard, **values):
+        lt = batch_leases_table
+        with self.engine.begin() as conn:
+            result = conn.execute(
+                update(lt)
+                .where(lt.c.run_id == self.run_id, lt.c.shard == shard,
+                       lt.c.owner == self.owner, lt.c.status == "leased")
+                .values(updated_at=func.now(), **values)
+            )
+        return result.rowcount == 1
+
+    def heartbeat(self, shard, progress_phone=None):
+        """
+        Extend the lease and save progress. False means the lease was lost
+        (it expired and another node took the shard) — stop working on it.
+        """
+        values = {"lease_expires_at": self._lease_until()}
+        if progress_phone is not None:
+            values["progress_phone"] = progress_phone
+        return self._update_own(shard, **values)
+
+    def release(self, shard, progress_phone=None):
+        """
+        Hand an unfinished shard back (e.g. at the deadline), keeping progress.
+        """
+        values = {"status": "pending", "owner": None, "lease_expires_at": None}
+        if progress_phone is not None:
+            values["progress_phone"] = progress_phone
+        return self._update_own(shard, **values)
+
+    def complete(self, shard):
+        return self._update_own(shard, status="done", lease_expires_at=None)
+
+    def fail(self, shard, progress_phone=None):
+        """
+        Park a shard whose parents kept failing. Not claimed again in this
+        run; ensure() puts it back to pending when the command is rerun.
+        """
+        values = {"status": "failed", "owner": None, "lease_expires_at": None}
+        if progress_phone is not None:
+            values["progress_phone"] = progress_phone
+        return self._update_own(shard, **values)
+
+    def counts(self):
+        """
+        {"pending": n, "leased": n, "done": n, "failed": n} for the run.
+        """
+        lt = batch_leases_table
+        with self.engine.connect() as conn:
+            rows = conn.execute(
+                select(lt.c.status, func.count())
+                .where(lt.c.run_id == self.run_id)
+                .group_by(lt.c.status)
+            ).all()
+        return dict(rows)
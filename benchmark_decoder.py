@@ -0,0 +1,93 @@
+"""
+benchmark_decoder.py
+--------------------
+Micro-benchmark: typed decoder (homework_decoder.py) vs the previous
+json.loads → generic dict path, on the sample payloads from
+gemini_weekly_report.py.
+✅ Checks both paths give the same compress_data / stats output first
+✅ Retained memory of one decoded batch (tracemalloc)
+✅ Decode only, and decode → compress_data → compute_homework_stats
+✅ p50 / p95 per batch via benchmark_pipeline.measure()
+
+Usage:
+    python benchmark_decoder.py
+    python benchmark_decoder.py --copies 50 --iterations 500
+"""
+
+import argparse
+import json
+import os
+import sys
+import tracemalloc
+
+
+def _generic_decode(raw):
+    # The normalization used before homework_decoder.py
+    try:
+        return json.loads(raw)
+    except ValueError:
+        return {"raw_text": raw}
+
+
+def _retained(decode):
+    # Bytes still allocated once a batch is decoded and held
+    tracemalloc.start()
+    batch = decode(0)
+    retained = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del batch
+    return retained
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the homework payload decoder.")
+    parser.add_argument("--copies", type=int, default=5, help="Sample payloads per batch (one student's week)")
+    parser.add_argument("--iterations", type=int, default=2000)
+    args = parser.parse_args()
+
+    # gemini_weekly_report → report_stats → metrics only; no database needed,
+    # but keep any .env DATABASE_URL from being required by accident
+    os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+    from benchmark_pipeline import measure
+    from gemini_weekly_report import SAMPLE_HOMEWORK_JSON, compress_data
+    from homework_decoder import decode_payload, Submission, JSON_BACKEND
+    from report_stats import compute_homework_stats
+
+    payloads = [json.dumps(hw, ensure_ascii=False) for hw in SAMPLE_HOMEWORK_JSON["data"]] * args.copies
+
+    def generic(i):
+        return {"data": [_generic_decode(raw) for raw in payloads]}
+
+    def typed(i):
+        return {"data": [decode_payload(raw) for raw in payloads]}
+
+    before, after = generic(0), typed(0)
+    if compress_data(before) != compress_data(after) or \
+            compute_homework_stats(before) != compute_homework_stats(after):
+        sys.exit("❌ Decoder output differs from the generic path")
+
+    size_before = len(json.dumps(before, ensure_ascii=False))
+    size_after = len(json.dumps(
+        [hw.to_json() if isinstance(hw, Submission) else hw for hw in after["data"]], ensure_ascii=False
+    ))
+    print("📘 SmartLearners.ai – Homework Decoder Benchmark\n")
+    print(f"🧾 {len(payloads)} payloads / batch, backend: {JSON_BACKEND}, "
+          f"normalized size {size_before:,} → {size_after:,} chars, "
+          f"retained memory {_retained(generic):,} → {_retained(typed):,} bytes\n")
+
+    n = args.iterations
+    print("⏱️  Decode")
+    measure("generic json.loads", generic, n)
+    measure("typed decoder", typed, n)
+
+    print("\n⏱️  Decode → compress_data → compute_homework_stats")
+    for name, decode in (("generic json.loads", generic), ("typed decoder", typed)):
+        def pipeline(i, decode=decode):
+            hw_json = decode(i)
+            return compress_data(hw_json), compute_homework_stats(hw_json)
+        measure(name, pipeline, n)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,364 @@
+"""
+benchmark_pipeline.py
+---------------------
+Offline benchmarks for the weekly report pipeline.
+✅ Seeded local database matching Users_student / myapp_homeworksubmission
+✅ Fake Gemini client with configurable latency (no network, no tokens)
+✅ compress_data, stats, row normalization, sibling query, report stage, PDF
+✅ Bulk endpoint path vs one request per parent
+✅ p50 / p95 latency and throughput, saved per commit for comparison
+
+Usage:
+    python benchmark_pipeline.py                                  # SQLite fixture
+    python benchmark_pipeline.py --llm-latency 0.5 --iterations 50
+    python benchmark_pipeline.py --database-url postgresql+psycopg2://.../scratch --reset
+    python benchmark_pipeline.py --compare benchmark_results/<older>.json
+"""
+
+import argparse
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+from datetime import datetime
+
+RESULTS_DIR = "benchmark_results"
+PDF_SIZES = [1, 5, 10, 25, 50]
+
+SAMPLE_REPORT = """Weekly Performance Summary 📘
+
+Overall Score: 72.5% 🎉
+Correct: 12 ✅  Partially-Correct: 5 🌟  Unattempted: 2 ⛔
+
+Strengths: Quadratic Equations, Coordinate Geometry
+Weak Areas: Probability, Heron's Formula
+
+Keep up the great work! You're making steady progress. 💪
+
+Note for Parents: steady progress this week, with focus needed on Probability."""
+
+
+# ======================================================
+# ✅ FAKE GEMINI CLIENT
+# ======================================================
+class _FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeGeminiModel:
+    """
+    Stands in for genai.GenerativeModel: sleeps `latency` seconds per call.
+    """
+
+    def __init__(self, latency, report=SAMPLE_REPORT):
+        self.latency = latency
+        self.report = report
+
+    def generate_content(self, prompt, stream=False, **kwargs):
+        if stream:
+            return self._stream()
+        time.sleep(self.latency)
+        return _FakeResponse(self.report)
+
+    def _stream(self):
+        lines = self.report.splitlines(keepends=True)
+        for line in lines:
+            time.sleep(self.latency / len(lines))
+            yield _FakeResponse(line)
+
+
+# ======================================================
+# ✅ SEEDED FIXTURE
+# ======================================================
+def _question(n, seed):
+    max_score = 10
+    score = (seed * 7 + n * 3) % (max_score + 1)
+    category = "Correct" if score >= 8 else "Unattempted" if score == 0 else "Partially-Correct"
+    return {
+        "topic": f"Topic {seed % 12}",
+        "comment": "Student wrote the first two steps correctly but " * 4,
+        "question": f"Question {n}: find the value of x for the given expression.",
+        "max_score": max_score,
+        "question_id": f"Q{n}",
+        "total_score": score,
+        "answer_category": category,
+        "concept_required": [f"Concept {seed % 9}", f"Concept {(seed + n) % 15}"],
+        "correction_comment": "Check the sign in the third line and simplify. " * 3,
+    }
+
+
+def _submission(hw_id, questions):
+    return {
+        "homework_id": f"HW-{hw_id:06d}",
+        "submission_date": f"2025-10-{1 + hw_id % 28:02d}T09:18:58Z",
+        "question": {"questions": [_question(n, hw_id + n) for n in range(1, questions + 1)]},
+    }
+
+
+def seed_fixture(engine, parents, children, submissions, questions, reset):
+    """
+    Create the fixture tables and fill them with `parents` phones, `children`
+    students each and `submissions` homework rows per student.
+
+    Returns:
+        List of seeded phone numbers
+    """
+    from sqlalchemy import select, func
+    from tables import (
+        metadata, students_table, homework_table, report_store_table, concept_mastery_table,
+        refresh_state_table,
+    )
+
+    # The service tables the report path reads start out empty
+    tables = [students_table, homework_table, report_store_table, concept_mastery_table,
+              refresh_state_table]
+    if reset:
+        metadata.drop_all(engine, tables=tables)
+    metadata.create_all(engine, tables=tables)
+
+    with engine.begin() as conn:
+        if conn.execute(select(func.count()).select_from(students_table)).scalar():
+            sys.exit("❌ Refusing to seed a non-empty database — use a scratch DB with --reset.")
+
+        phones, students, rows = [], [], []
+        hw_id = 0
+        for p in range(parents):
+            phone = f"90000{p:05d}"
+            phones.append(phone)
+            for c in range(children):
+                student_id = p * children + c + 1
+                username = f"BENCH{student_id}"
+                students.append({
+                    "id": student_id, "username": username, "fullname": f"Student {student_id}",
+                    "phone_number": phone, "class_name_id": 10, "section": "A",
+                })
+                for _ in range(submissions):
+                    hw_id += 1
+                    rows.append({
+                        "id": hw_id,
+                        # Half linked by FK, half only by username — both query branches
+                        "student_name_id": student_id if hw_id % 2 else None,
+                        "student_id": username,
+                        "homework_id": hw_id,
+                        "agent_analysis_data": json.dumps(_submission(hw_id, questions)),
+                        "score": 7.0, "percentage": 70.0, "grade": "B",
+                    })
+
+        conn.execute(students_table.insert(), students)
+        conn.execute(homework_table.insert(), rows)
+
+    return phones
+
+
+# ======================================================
+# ✅ TIMING
+# ======================================================
+def _percentile(sorted_values, pct):
+    index = max(0, min(len(sorted_values) - 1, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def measure(name, fn, iterations, warmup=2):
+    """
+    Run fn() `iterations` times and summarize the latencies.
+    """
+    # The pipeline prints progress; keep it out of the results table
+    with redirect_stdout(io.StringIO()):
+        for i in range(warmup):
+            fn(i)
+
+        latencies = []
+        started = time.perf_counter()
+        for i in range(iterations):
+            t0 = time.perf_counter()
+            fn(i)
+            latencies.append(time.perf_counter() - t0)
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    result = {
+        "name": name,
+        "iterations": iterations,
+        "p50_ms": round(_percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(_percentile(latencies, 95) * 1000, 3),
+        "mean_ms": round(sum(latencies) / iterations * 1000, 3),
+        "throughput_per_s": round(iterations / elapsed, 2) if elapsed else None,
+    }
+    print(f"  {name:<40} p50 {result['p50_ms']:>10.3f} ms   p95 {result['p95_ms']:>10.3f} ms"
+          f"   {result['throughput_per_s']:>10} /s")
+    return result
+
+
+# ======================================================
+# ✅ BENCHMARKS
+# ======================================================
+def run_benchmarks(args, phones):
+    from sqlalchemy.orm import Session
+    from database import engine
+    from gemini_weekly_report import compress_data, generate_weekly_report, set_model_factory
+    from homework_data import fetch_sibling_homework, decode_submission, collect_student_homework
+    from report_stats import compute_homework_stats
+    from report_cache import report_cache
+    from report_pipeline import generate_reports, build_student_reports, build_bulk_reports
+    from pdf_generator import create_pdf_report
+    from tables import report_store_table
+
+    fake_model = FakeGeminiModel(args.llm_latency)
+    set_model_factory(lambda: fake_model)
+
+    n = args.iterations
+    results = []
+
+    with Session(engine) as db, redirect_stdout(io.StringIO()):
+        _, sample_data = collect_student_homework(db, phones[0])
+        siblings = fetch_sibling_homework(db, phones[0])
+    hw_json = next(iter(sample_data.values()))
+    rows = [row for _, subs in siblings for row in subs]
+
+    print(f"\n⏱️  Data stages ({len(rows)} rows / parent, {len(hw_json['data'])} per student)")
+    results.append(measure("compress_data", lambda i: compress_data(hw_json), n * 10))
+    results.append(measure("compute_homework_stats", lambda i: compute_homework_stats(hw_json), n * 10))
+    results.append(measure("normalize_rows[parent]", lambda i: [decode_submission(r) for r in rows], n * 10))
+
+    def sibling_query(i):
+        with Session(engine) as db:
+            fetch_sibling_homework(db, phones[i % len(phones)])
+    results.append(measure(f"sibling_query[{engine.dialect.name}]", sibling_query, n))
+
+    print(f"\n⏱️  Report stage (fake Gemini latency {args.llm_latency * 1000:.0f} ms)")
+    results.append(measure("generate_weekly_report", lambda i: generate_weekly_report(hw_json), n))
+
+    def cold_reports(i):
+        report_cache.clear()
+        generate_reports(sample_data)
+    results.append(measure(f"generate_reports[{len(sample_data)} students, cold]", cold_reports, n))
+    results.append(measure(f"generate_reports[{len(sample_data)} students, cached]",
+                           lambda i: generate_reports(sample_data), n))
+
+    print("\n⏱️  PDF stage")
+    for size in PDF_SIZES:
+        reports = {f"student{k}": SAMPLE_REPORT for k in range(size)}
+        iterations = max(3, n // size)
+        results.append(measure(f"create_pdf_report[{size}]", lambda i: create_pdf_report(reports), iterations))
+
+    print("\n⏱️  End to end (query → reports → PDF, cold cache)")
+
+    def end_to_end(i):
+        report_cache.clear()
+        with Session(engine) as db:
+            _, data = collect_student_homework(db, phones[i % len(phones)])
+        create_pdf_report(generate_reports(data))
+    results.append(measure("end_to_end[parent]", end_to_end, n))
+
+    print(f"\n⏱️  All {len(phones)} parents (cold cache and report store)")
+
+    def cold():
+        # Stored reports would otherwise answer every run after the warmup
+        report_cache.clear()
+        with engine.begin() as conn:
+            conn.execute(report_store_table.delete())
+
+    def one_by_one(i):
+        cold()
+        for phone in phones:
+            build_student_reports(phone)
+
+    def bulk(i):
+        cold()
+        build_bulk_reports(mobile_numbers=phones)
+    iterations = max(3, n // 5)
+    results.append(measure(f"reports_per_parent[{len(phones)}]", one_by_one, iterations, warmup=1))
+    results.append(measure(f"reports_bulk[{len(phones)}]", bulk, iterations, warmup=1))
+
+    return results
+
+
+# ======================================================
+# ✅ RESULTS
+# ======================================================
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def save_results(args, results):
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    commit = _git_commit()
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    filename = os.path.join(RESULTS_DIR, f"{timestamp}_{commit}.json")
+    with open(filename, "w", encoding="utf-8") as f:
+        json.dump({
+            "commit": commit,
+            "timestamp": timestamp,
+            "params": {k: v for k, v in vars(args).items() if k not in ("compare", "database_url")},
+            "results": results,
+        }, f, indent=2)
+    return filename
+
+
+def compare_results(previous_file, results):
+    with open(previous_file, encoding="utf-8") as f:
+        previous = json.load(f)
+    before = {r["name"]: r for r in previous["results"]}
+
+    print(f"\n📊 Compared with {previous['commit']} ({previous['timestamp']})")
+    for r in results:
+        old = before.get(r["name"])
+        if not old:
+            continue
+        deltas = [
+            f"{metric} {(r[metric] - old[metric]) / old[metric] * 100:+6.1f}%"
+            for metric in ("p50_ms", "p95_ms") if old[metric]
+        ]
+        print(f"  {r['name']:<40} " + "   ".join(deltas))
+
+
+# ======================================================
+# ✅ MAIN
+# ======================================================
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the weekly report pipeline offline.")
+    parser.add_argument("--database-url", help="Scratch database (default: temporary SQLite file)")
+    parser.add_argument("--reset", action="store_true", help="Drop and recreate the fixture tables")
+    parser.add_argument("--parents", type=int, default=20)
+    parser.add_argument("--children", type=int, default=3)
+    parser.add_argument("--submissions", type=int, default=10, help="Homework rows per student")
+    parser.add_argument("--questions", type=int, default=5, help="Questions per homework")
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="Fake Gemini seconds per call")
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--compare", help="Earlier results JSON to diff against")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="corn_bench_")
+    # Project modules read these at import time
+    os.environ["DATABASE_URL"] = args.database_url or f"sqlite:///{os.path.join(workdir, 'fixture.db')}"
+    os.environ["REPORT_CACHE_DB"] = os.path.join(workdir, "report_cache.sqlite3")
+
+    from database import engine
+
+    print("📘 SmartLearners.ai – Report Pipeline Benchmarks\n")
+    print(f"🗄️  Seeding {args.parents} parents × {args.children} children × "
+          f"{args.submissions} submissions ({engine.dialect.name})")
+    phones = seed_fixture(engine, args.parents, args.children, args.submissions,
+                          args.questions, reset=args.reset or not args.database_url)
+
+    results = run_benchmarks(args, phones)
+    filename = save_results(args, results)
+    print(f"\n✅ Results saved to {filename}")
+
+    if args.compare:
+        compare_results(args.compare, results)
+
+
+if __name__ == "__main__":
+    main()
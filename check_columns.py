@@ -1,12 +1,6 @@
-from sqlalchemy import create_engine, inspect
+from sqlalchemy import inspect
+from database import engine
 
-DATABASE_URL = (
-    "postgresql+psycopg2://doadmin:AVNS_FtaTHZQtmY1WSQsZ6yM@"
-    "edtechdatabase-do-user-18137285-0.f.db.ondigitalocean.com:25061/schools-pool"
-    "?sslmode=require"
-)
-
-engine = create_engine(DATABASE_URL)
 inspector = inspect(engine)
 
 table_name = "myapp_homeworksubmission"
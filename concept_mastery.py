@@ -0,0 +1,238 @@
+"""
+concept_mastery.py
+------------------
+Per-student, per-concept mastery index built from concept_required.
+✅ One row per (student, concept): attempts, earned / max score, last seen
+   and an exponentially decayed mastery — recent homework weighs more
+   (half-life CONCEPT_MASTERY_HALF_LIFE_DAYS)
+✅ Updated incrementally by `weekly_aggregates.py update`, from the same
+   id-watermark batches and change queue as the weekly totals (with its
+   own watermark)
+✅ Each submission's observations are kept per (submission, concept): a
+   changed submission is retracted and its (student, concept) rows are
+   re-folded from their remaining observations
+✅ Reports quote the top-k strong / weak concepts from the index, so the
+   request's per-question concept lists are no longer needed for them
+✅ Table lives in the service database (migrations.py / tables.py)
+
+Decayed mastery is decayed earned / decayed max. Both decay at the same
+rate, so the ratio only changes when the student is scored on the concept
+again — reading it needs no "as of" time.
+"""
+
+import os
+from collections import defaultdict
+from datetime import datetime, timezone
+from dotenv import load_dotenv
+from sqlalchemy import select, delete, func, tuple_
+from sqlalchemy.dialects import postgresql, sqlite
+
+from tables import concept_mastery_table, concept_observations_table
+from report_stats import _number, _percent, TOP_CONCEPTS, STRONG_THRESHOLD
+
+load_dotenv()
+
+# ======================================================
+# ✅ MASTERY CONFIG
+# ======================================================
+CONCEPT_MASTERY_HALF_LIFE_DAYS = float(os.getenv("CONCEPT_MASTERY_HALF_LIFE_DAYS", "28"))
+# Concepts seen fewer times are left out of the strong / weak lists
+CONCEPT_MASTERY_MIN_ATTEMPTS = int(os.getenv("CONCEPT_MASTERY_MIN_ATTEMPTS", "2"))
+
+_KEY_CHUNK = 500   # (student, concept) pairs per lookup / upsert statement
+
+# The index's consumer name, i.e. its watermark row in report_refresh_state
+MASTERY_CONSUMER = "concept_mastery"
+
+
+def _insert(conn, table):
+    dialect = postgresql if conn.dialect.name == "postgresql" else sqlite
+    return dialect.insert(table)
+
+
+def _concepts(required):
+    """
+    The distinct concept names of a question's concept_required.
+    """
+    if isinstance(required, str):
+        required = [required]
+    if not isinstance(required, (list, tuple)):
+        return set()
+    return {c.strip() for c in required if isinstance(c, str) and c.strip()}
+
+
+def _decay(value, seen, until):
+    # Weight of something scored at `seen`, looked at from `until`
+    days = (until - seen).total_seconds() / 86400
+    return value * 0.5 ** (days / CONCEPT_MASTERY_HALF_LIFE_DAYS)
+
+
+def _empty_state():
+    return {"attempts": 0, "total_score": 0.0, "max_score": 0.0, "decayed_score": 0.0,
+            "decayed_max": 0.0, "mastery": None, "last_seen": None}
+
+
+def observe(state, seen, earned, possible, attempts=1):
+    """
+    Add scored questions (`attempts` of them, seen at the same time) to a
+    concept's state, in any time order: the decayed sums are always kept
+    as of state["last_seen"].
+    """
+    state["attempts"] += attempts
+    state["total_score"] += earned
+    state["max_score"] += possible
+    last_seen = state["last_seen"]
+    if last_seen is None or seen >= last_seen:
+        if last_seen is not None:
+            state["decayed_score"] = _decay(state["decayed_score"], last_seen, seen)
+            state["decayed_max"] = _decay(state["decayed_max"], last_seen, seen)
+        state["last_seen"] = seen
+        state["decayed_score"] += earned
+        state["decayed_max"] += possible
+    else:
+        # A late-arriving older submission
+        state["decayed_score"] += _decay(earned, seen, last_seen)
+        state["decayed_max"] += _decay(possible, seen, last_seen)
+    state["mastery"] = _percent(state["decayed_score"], state["decayed_max"])
+    return state
+
+
+# ======================================================
+# ✅ INCREMENTAL UPDATE
+# ======================================================
+def fold_observations(folded):
+    """
+    One observation row per (submission, concept) from
+    weekly_aggregates.decode_rows() output: the questions that required
+    the concept, summed.
+    """
+    observations = {}
+    for row in folded:
+        if row.submission is None:
+            continue
+        for q in row.submission.questions:
+            earned, possible = _number(q.total_score), _number(q.max_score)
+            for concept in _concepts(q.concept_required):
+                observation = observations.setdefault((row.submission_id, concept), {
+                    "submission_id": row.submission_id, "concept": concept, "student_id": row.student_id,
+                    "seen": row.submitted, "attempts": 0, "total_score": 0.0, "max_score": 0.0,
+                })
+                observation["attempts"] += 1
+                observation["total_score"] += earned
+                observation["max_score"] += possible
+    return list(observations.values())
+
+
+def apply_concept_mastery(conn, ids, folded):
+    """
+    Swap the batch's observations for freshly decoded ones (a submission
+    that is gone or can't be attributed any more just loses its own), then
+    re-fold every (student, concept) touched, before or after. Safe
+    because weekly_aggregates.py holds the consumer's watermark row FOR
+    UPDATE for the whole transaction.
+    """
+    o = concept_observations_table
+    pairs = set(conn.execute(
+        delete(o).where(o.c.submission_id.in_(ids)).returning(o.c.student_id, o.c.concept)
+    ).all())
+    rows = fold_observations(folded)
+    if rows:
+        conn.execute(o.insert(), rows)
+    pairs.update((row["student_id"], row["concept"]) for row in rows)
+    _refold(conn, list(pairs))
+
+
+def _refold(conn, pairs):
+    # Concepts left without observations are dropped
+    o, cm = concept_observations_table, concept_mastery_table
+    now = datetime.now(timezone.utc)
+    stmt = _insert(conn, cm)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[cm.c.student_id, cm.c.concept],
+        set_={column: stmt.excluded[column] for column in (*_empty_state(), "updated_at")},
+    )
+    for i in range(0, len(pairs), _KEY_CHUNK):
+        chunk = pairs[i:i + _KEY_CHUNK]
+        states = {}
+        observations = conn.execute(
+            select(o.c.student_id, o.c.concept, o.c.seen, o.c.attempts, o.c.total_score, o.c.max_score)
+            .where(tuple_(o.c.student_id, o.c.concept).in_(chunk))
+            .order_by(o.c.seen)
+        ).all()
+        for row in observations:
+            state = states.setdefault((row.student_id, row.concept), _empty_state())
+            observe(state, row.seen, row.total_score, row.max_score, row.attempts)
+        if states:
+            conn.execute(stmt, [
+                {"student_id": key[0], "concept": key[1], "updated_at": now, **state}
+                for key, state in states.items()
+            ])
+        empty = [pair for pair in chunk if pair not in states]
+        if empty:
+            conn.execute(delete(cm).where(tuple_(cm.c.student_id, cm.c.concept).in_(empty)))
+
+
+# ======================================================
+# ✅ READING
+# ======================================================
+def top_concepts(rows, top_k=TOP_CONCEPTS):
+    """
+    Strongest and weakest concepts of one student's index rows, split at
+    STRONG_THRESHOLD like report_stats.
+    """
+    entries = sorted(
+        (
+            {"concept": row.concept, "percentage": row.mastery, "attempts": row.attempts,
+             "last_seen": row.last_seen.date().isoformat()}
+            for row in rows
+        ),
+        key=lambda entry: (-entry["percentage"], entry["concept"]),
+    )
+    strong = [e for e in entries if e["percentage"] >= STRONG_THRESHOLD][:top_k]
+    weak = [e for e in reversed(entries) if e["percentage"] < STRONG_THRESHOLD][:top_k]
+    return {"strong_concepts": strong, "weak_concepts": weak}
+
+
+def mastery_marker(student_id):
+    """
+    Scalar subqueries marking a student's index rows: their count and
+    newest updated_at. Every re-fold of one of the student's concepts
+    changes one or the other.
+    """
+    cm = concept_mastery_table
+    match = cm.c.student_id == student_id
+    return (
+        select(func.count()).where(match).scalar_subquery(),
+        select(func.max(cm.c.updated_at)).where(match).scalar_subquery(),
+    )
+
+
+def _mastery_query(student_ids):
+    # student_ids: a list, or a select of ids (migrations.py explain)
+    cm = concept_mastery_table
+    return (
+        select(cm.c.student_id, cm.c.concept, cm.c.attempts, cm.c.mastery, cm.c.last_seen)
+        .where(
+            cm.c.student_id.in_(student_ids),
+            cm.c.attempts >= CONCEPT_MASTERY_MIN_ATTEMPTS,
+            cm.c.mastery.is_not(None),
+        )
+    )
+
+
+def load_concept_mastery(db, student_ids, top_k=TOP_CONCEPTS):
+    """
+    Top-k strong / weak concepts for each student, in one query.
+
+    Returns:
+        {student_id: {"strong_concepts": [...], "weak_concepts": [...]}} —
+        students without an indexed concept are left out
+    """
+    student_ids = list(student_ids)
+    if not student_ids:
+        return {}
+    rows = db.execute(_mastery_query(student_ids)).all()
+    by_student = defaultdict(list)
+    for row in rows:
+        by_student[row.student_id].append(row)
+    return {student_id: top_concepts(rows, top_k) for student_id, rows in by_student.items()}
@@ -1,8 +1,12 @@
 # database.py
 from sqlalchemy import create_engine
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
 from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.pool import QueuePool
 from dotenv import load_dotenv
 import os
+import threading
+import time
 
 # Load .env variables
 load_dotenv()
@@ -12,8 +16,72 @@ DATABASE_URL = os.getenv("DATABASE_URL")
 if not DATABASE_URL:
     raise ValueError("❌ DATABASE_URL not found. Check your .env file.")
 
+# Pool tuning (per process — total connections = workers × (size + overflow))
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "5"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "30000"))
+
+
+class TimedQueuePool(QueuePool):
+    """
+    QueuePool that records how long callers wait for a connection.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self.checkouts = 0
+        self.checkout_timeouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            with self._stats_lock:
+                self.checkout_timeouts += 1
+            raise
+        finally:
+            waited = time.perf_counter() - started
+            with self._stats_lock:
+                self.checkouts += 1
+                self.wait_seconds_total += waited
+                self.wait_seconds_max = max(self.wait_seconds_max, waited)
+
+
+def create_db_engine(url=DATABASE_URL, **overrides):
+    """
+    The one place engines are built. Postgres gets the tuned, instrumented
+    pool and a server-side statement timeout; other URLs (e.g. SQLite
+    fixtures) keep SQLAlchemy's defaults.
+    """
+    options = {"pool_pre_ping": True, "future": True}
+
+    if url.startswith("postgresql"):
+        options.update(
+            poolclass=TimedQueuePool,
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_timeout=DB_POOL_TIMEOUT,
+            pool_recycle=DB_POOL_RECYCLE,
+            connect_args={"options": f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}"},
+        )
+
+    options.update(overrides)
+    return create_engine(url, **options)
+
+
 # Create SQLAlchemy engine (with SSL for DO)
-engine = create_engine(DATABASE_URL, pool_pre_ping=True)
+engine = create_db_engine()
+
+# A forked worker (gunicorn --preload, multiprocessing) must not reuse the
+# parent's sockets: drop the inherited pool without closing them
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=lambda: engine.dispose(close=False))
 
 # Session setup
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
@@ -28,3 +96,36 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+def pool_stats():
+    """
+    Snapshot of the engine's connection pool.
+    """
+    pool = engine.pool
+    stats = {
+        "pool_class": type(pool).__name__,
+        "status": pool.status(),
+    }
+
+    if isinstance(pool, QueuePool):
+        stats.update(
+            size=pool.size(),
+            checked_in=pool.checkedin(),
+            checked_out=pool.checkedout(),
+            overflow=max(pool.overflow(), 0),
+            max_overflow=pool._max_overflow,
+        )
+
+    if isinstance(pool, TimedQueuePool):
+        with pool._stats_lock:
+            checkouts = pool.checkouts
+            stats.update(
+                checkouts=checkouts,
+                checkout_timeouts=pool.checkout_timeouts,
+                wait_seconds_total=round(pool.wait_seconds_total, 6),
+                wait_seconds_avg=round(pool.wait_seconds_total / checkouts, 6) if checkouts else 0.0,
+                wait_seconds_max=round(pool.wait_seconds_max, 6),
+            )
+
+    return stats
@@ -1,19 +1,6 @@
-from sqlalchemy import create_engine, select, MetaData
-from sqlalchemy.orm import sessionmaker
-
-DATABASE_URL = (
-    "postgresql+psycopg2://doadmin:AVNS_FtaTHZQtmY1WSQsZ6yM@"
-    "edtechdatabase-do-user-18137285-0.f.db.ondigitalocean.com:25061/schools-pool"
-    "?sslmode=require"
-)
-
-engine = create_engine(DATABASE_URL, echo=False, future=True)
-SessionLocal = sessionmaker(bind=engine)
-metadata = MetaData()
-metadata.reflect(bind=engine)
-
-students_table = metadata.tables["Users_student"]
-homework_table = metadata.tables["myapp_homeworksubmission"]
+from sqlalchemy import select
+from database import SessionLocal
+from tables import students_table, homework_table
 
 db = SessionLocal()
 
@@ -6,6 +6,7 @@ gemini_weekly_report_v3.py
 ✅ Generates Gemini report per student
 ✅ Writes all reports to 'weekly_reports.txt'
 ✅ Optimized for speed + safety
+✅ Optional run_id: checkpointed per student, a rerun resumes (batch_checkpoint.py)
 """
 
 import json
@@ -13,6 +14,7 @@ import google.generativeai as genai
 from datetime import datetime
 import os
 import textwrap
+from batch_checkpoint import CheckpointStore, write_atomic
 
 # ======================================================
 # 1️⃣  CONFIGURE GEMINI
@@ -96,22 +98,38 @@ def generate_weekly_report(student_name, homework_json):
 # ======================================================
 # 4️⃣  MULTI-STUDENT LOOP + FILE SAVE
 # ======================================================
-def generate_reports_for_students(students_homework):
+def generate_reports_for_students(students_homework, run_id=None, checkpoints=None):
     """
     Loop through all students under a parent phone number and
     generate their weekly Gemini reports.
+
+    With a run_id, each finished report is checkpointed and the output goes
+    to weekly_reports_<run_id>.txt; calling again with the same run_id only
+    generates the students that did not finish (errors are retried).
     """
     reports = []
+    done = {}
+    if run_id is not None:
+        checkpoints = checkpoints or CheckpointStore()
+        done = checkpoints.student_reports(run_id, [""]).get("", {})
 
     for student_name, data in students_homework.items():
+        if student_name in done:
+            print(f"♻️  {student_name} already done in run {run_id}")
+            reports.append(done[student_name])
+            continue
         print(f"🧠 Generating report for {student_name}...")
         report_text = generate_weekly_report(student_name, data)
+        if run_id is not None and not report_text.startswith("❌"):
+            checkpoints.record_student(run_id, "", student_name, report_text)
         reports.append(report_text)
 
-    # Save all reports to file
-    filename = f"weekly_reports_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt"
-    with open(filename, "w", encoding="utf-8") as f:
-        f.writelines(reports)
+    # Save all reports to file (atomically, so a rerun replaces it cleanly)
+    if run_id is not None:
+        filename = f"weekly_reports_{run_id}.txt"
+    else:
+        filename = f"weekly_reports_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt"
+    write_atomic(filename, "".join(reports))
 
     print(f"\n✅ All reports saved to {filename}\n")
     return filename
@@ -0,0 +1,476 @@
+"""
+homework_data.py
+----------------
+Data access shared by the weekly report endpoints.
+✅ One round-trip fetches the latest N submissions for every sibling of a phone
+✅ FK (student_name_id) and username (student_id) matches run as separate,
+   index-friendly branches instead of a single OR
+✅ Postgres uses a LATERAL top-N per student, other databases a window function
+✅ Postgres matches phone numbers on their digits (ix_student_phone_digits),
+   so "+91 75696-30144" and "917569630144" find the same parent
+✅ Bulk mode: many phones (one IN list) or a whole class / section in the
+   same single query, grouped back per phone
+✅ Optional [week_start, week_end) window on submission_date, capped per
+   student (HOMEWORK_MAX_SUBMISSIONS) — a range scan on (student, date)
+✅ Projects only the columns the report uses; result_json is fetched in a
+   second, targeted query only for rows without agent_analysis_data
+✅ Optional (HOMEWORK_SERVER_SIDE_EXTRACT=1): Postgres extracts just the
+   question fields the report needs from agent_analysis_data
+✅ Decodes each submission into the typed records of homework_decoder.py,
+   consumed as they are by the report statistics
+✅ Attaches each student's top strong / weak concepts from the mastery
+   index (concept_mastery.py; HOMEWORK_CONCEPT_MASTERY=0 turns it off)
+"""
+
+import logging
+import os
+import re
+from collections import namedtuple
+from datetime import datetime, time, timedelta
+from dotenv import load_dotenv
+from sqlalchemy import select, union, func, and_, or_, true, literal_column
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.exc import DataError
+from tables import students_table, homework_table, phone_digits
+from homework_decoder import decode_payload
+from concept_mastery import load_concept_mastery
+from metrics import track_stage
+
+
+load_dotenv()
+
+HOMEWORK_SERVER_SIDE_EXTRACT = os.getenv("HOMEWORK_SERVER_SIDE_EXTRACT", "0") == "1"
+HOMEWORK_CONCEPT_MASTERY = os.getenv("HOMEWORK_CONCEPT_MASTERY", "1") == "1"
+
+# Without a date window: latest N by id. With one: every submission in the
+# window, newest first, up to the cap
+HOMEWORK_RECENT_LIMIT = 5
+HOMEWORK_MAX_SUBMISSIONS = int(os.getenv("HOMEWORK_MAX_SUBMISSIONS", "50"))
+
+Sibling = namedtuple("Sibling", ["id", "username", "phone_number"], defaults=(None,))
+Submission = namedtuple(
+    "Submission",
+    ["id", "agent_analysis_data", "result_json", "score", "percentage", "grade"],
+)
+
+
+def _submission_columns(h, extract=False):
+    # result_json is deliberately left out — see _fill_result_json()
+    return (
+        h.c.id,
+        _extracted_analysis(h) if extract else h.c.agent_analysis_data,
+        h.c.score,
+        h.c.percentage,
+        h.c.grade,
+    )
+
+
+def _extracted_analysis(h):
+    """
+    Postgres expression returning only homework_id, submission_date and
+    question.questions[*].{topic,total_score,max_score,answer_category,
+    concept_required} of agent_analysis_data, as jsonb (decoded by the driver).
+    Comments, correction_comment and question text never leave the server.
+    """
+    column = h.c.agent_analysis_data.compile(dialect=postgresql.dialect())
+    doc = f"({column})::jsonb"
+    questions = f"{doc} -> 'question' -> 'questions'"
+    return literal_column(f"""
+        CASE WHEN {column} IS NULL OR {column} = '' THEN NULL
+             WHEN jsonb_typeof({doc}) <> 'object' THEN to_jsonb({column}) ELSE
+        jsonb_build_object(
+            'homework_id', {doc} -> 'homework_id',
+            'submission_date', {doc} -> 'submission_date',
+            'question', jsonb_build_object('questions', COALESCE((
+                SELECT jsonb_agg(jsonb_build_object(
+                    'topic', q -> 'topic',
+                    'total_score', q -> 'total_score',
+                    'max_score', q -> 'max_score',
+                    'answer_category', q -> 'answer_category',
+                    'concept_required', q -> 'concept_required'
+                ) ORDER BY ord)
+                FROM jsonb_array_elements(
+                    CASE WHEN jsonb_typeof({questions}) = 'array'
+                         THEN {questions} ELSE '[]'::jsonb END
+                ) WITH ORDINALITY AS extracted(q, ord)
+            ), '[]'::jsonb))
+        ) END""").label("agent_analysis_data")
+
+
+# ======================================================
+# ✅ WEEK WINDOW
+# ======================================================
+def week_window(week_start=None, week_end=None):
+    """
+    Resolve optional dates into a half-open [start, end) datetime window.
+    A missing bound is taken as 7 days from the other one.
+
+    Returns:
+        (start, end) datetimes, or None when neither bound is given
+
+    Raises:
+        ValueError: if week_end is not after week_start
+    """
+    if week_start is None and week_end is None:
+        return None
+
+    def as_datetime(value):
+        return value if isinstance(value, datetime) else datetime.combine(value, time.min)
+
+    start = as_datetime(week_start) if week_start is not None else None
+    end = as_datetime(week_end) if week_end is not None else None
+    if start is None:
+        start = end - timedelta(days=7)
+    if end is None:
+        end = start + timedelta(days=7)
+    if end <= start:
+        raise ValueError("week_end must be after week_start")
+    return start, end
+
+
+def submission_limit(limit=None, week=None):
+    """
+    Submissions per student: HOMEWORK_RECENT_LIMIT without a window, the cap
+    with one; an explicit limit is clamped to the cap.
+    """
+    if limit is None:
+        limit = HOMEWORK_MAX_SUBMISSIONS if week else HOMEWORK_RECENT_LIMIT
+    return max(1, min(limit, HOMEWORK_MAX_SUBMISSIONS))
+
+
+def normalize_phone(mobile_number):
+    """
+    Digits only — the Python side of tables.phone_digits().
+    """
+    return re.sub(r"[^0-9]", "", mobile_number or "")
+
+
+def phone_filter(mobile_numbers, normalized=True):
+    """
+    Students whose phone is any of `mobile_numbers`. Normalized (Postgres)
+    compares digits, served by ix_student_phone_digits; otherwise exact.
+    Digit-free input is always matched exactly.
+    """
+    s = students_table
+    if not normalized:
+        return s.c.phone_number.in_(list(mobile_numbers))
+
+    digits = sorted({normalize_phone(p) for p in mobile_numbers} - {""})
+    raw = [p for p in mobile_numbers if not normalize_phone(p)]
+    clauses = []
+    if digits:
+        clauses.append(phone_digits(s.c.phone_number).in_(digits))
+    if raw:
+        clauses.append(s.c.phone_number.in_(raw))
+    return or_(*clauses)
+
+
+def class_filter(class_name_id, section=None):
+    """
+    Every student of a class, optionally one section (ix_student_class_section).
+    """
+    s = students_table
+    clause = s.c.class_name_id == class_name_id
+    return and_(clause, s.c.section == section) if section is not None else clause
+
+
+def _newest_first(columns, week):
+    # Dated windows are read off the (student, submission_date) indexes
+    if week:
+        return (columns.submission_date.desc(), columns.id.desc())
+    return (columns.id.desc(),)
+
+
+def _in_week(h, week):
+    return and_(h.c.submission_date >= week[0], h.c.submission_date < week[1])
+
+
+# ======================================================
+# ✅ SIBLING HOMEWORK QUERY
+# ======================================================
+def _lateral_query(students, limit, extract=False, week=None):
+    """
+    Postgres: for each student matching the `students` clause (see
+    phone_filter / class_filter), take the top-N ids from each match branch
+    (both served by an index on (column, id), or (column, submission_date)
+    for a week window), merge them and keep the top N.
+    """
+    s, h = students_table, homework_table
+
+    def branch(match):
+        stmt = select(h.c.id, h.c.submission_date).where(match)
+        if week:
+            stmt = stmt.where(_in_week(h, week))
+        return stmt.order_by(*_newest_first(h.c, week)).limit(limit).correlate(s)
+
+    by_fk = branch(h.c.student_name_id == s.c.id)
+    by_username = branch(h.c.student_id == s.c.username)
+    ids = union(by_fk, by_username).subquery("matched")
+    picked = (
+        select(ids.c.id)
+        .order_by(*_newest_first(ids.c, week))
+        .limit(limit)
+        .lateral("picked")
+    )
+
+    return (
+        select(
+            s.c.id.label("sibling_id"),
+            s.c.username.label("sibling_username"),
+            s.c.phone_number.label("sibling_phone"),
+            *_submission_columns(h, extract),
+        )
+        .select_from(
+            s.outerjoin(picked, true()).outerjoin(h, h.c.id == picked.c.id)
+        )
+        .where(students)
+        .order_by(s.c.id, *_newest_first(h.c, week))
+    )
+
+
+def _window_query(students, limit, week=None):
+    """
+    Portable fallback: rank every matching submission per sibling with
+    row_number() and keep the first N.
+    """
+    s, h = students_table, homework_table
+
+    def branch(match):
+        stmt = (
+            select(h.c.id, h.c.submission_date, s.c.id.label("sid"))
+            .join(s, match)
+            .where(students)
+        )
+        return stmt.where(_in_week(h, week)) if week else stmt
+
+    by_fk = branch(h.c.student_name_id == s.c.id)
+    by_username = branch(h.c.student_id == s.c.username)
+    matched = union(by_fk, by_username).subquery("matched")
+    ranked = select(
+        matched.c.id.label("hw_id"),
+        matched.c.sid,
+        func.row_number().over(
+            partition_by=matched.c.sid,
+            order_by=_newest_first(matched.c, week),
+        ).label("rn"),
+    ).subquery("ranked")
+
+    return (
+        select(
+            s.c.id.label("sibling_id"),
+            s.c.username.label("sibling_username"),
+            s.c.phone_number.label("sibling_phone"),
+            *_submission_columns(h),
+        )
+        .select_from(
+            s.outerjoin(ranked, and_(ranked.c.sid == s.c.id, ranked.c.rn <= limit))
+            .outerjoin(h, h.c.id == ranked.c.hw_id)
+        )
+        .where(students)
+        .order_by(s.c.id, *_newest_first(h.c, week))
+    )
+
+
+def fetch_sibling_homework(db, mobile_number, limit=None, extract=HOMEWORK_SERVER_SIDE_EXTRACT,
+                           week=None):
+    """
+    Fetch the latest submissions of every student linked to a phone number
+    in a single query.
+
+    `week` is an optional [start, end) window from week_window(); `limit`
+    defaults per submission_limit(). `extract` (Postgres only) trims
+    agent_analysis_data server-side to the fields the report uses. If some
+    row is not valid JSON the cast fails, and the query is re-run returning
+    full payloads.
+
+    Returns:
+        List of (student, [submission rows, newest first]) in student id order.
+        Students without homework are included with an empty list.
+    """
+    postgres = db.get_bind().dialect.name == "postgresql"
+    return fetch_students_homework(
+        db, phone_filter([mobile_number], normalized=postgres),
+        limit=limit, extract=extract, week=week, label=mobile_number,
+    )
+
+
+def fetch_students_homework(db, students, limit=None, extract=HOMEWORK_SERVER_SIDE_EXTRACT,
+                            week=None, label="students"):
+    """
+    fetch_sibling_homework() for any set of students — a phone_filter() over
+    many phones or a class_filter(). `label` only names the set in logs.
+    """
+    limit = submission_limit(limit, week)
+    if db.get_bind().dialect.name != "postgresql":
+        rows = db.execute(_window_query(students, limit, week)).all()
+    elif extract:
+        try:
+            with db.begin_nested():
+                rows = db.execute(_lateral_query(students, limit, True, week)).all()
+        except DataError:
+            logging.warning(f"Invalid analysis JSON for {label}; fetching full payloads")
+            rows = db.execute(_lateral_query(students, limit, week=week)).all()
+    else:
+        rows = db.execute(_lateral_query(students, limit, week=week)).all()
+
+    siblings = {}
+    for row in rows:
+        if row.sibling_id not in siblings:
+            siblings[row.sibling_id] = (
+                Sibling(row.sibling_id, row.sibling_username, row.sibling_phone), []
+            )
+        if row.id is not None:
+            siblings[row.sibling_id][1].append(
+                Submission(row.id, row.agent_analysis_data, None, row.score, row.percentage, row.grade)
+            )
+
+    result = list(siblings.values())
+    _fill_result_json(db, result)
+    return result
+
+
+def _fill_result_json(db, siblings):
+    """
+    Load result_json only where agent_analysis_data is empty — the only rows
+    that fall back to it — instead of shipping both large columns for every row.
+    """
+    missing = [sub.id for _, subs in siblings for sub in subs if not sub.agent_analysis_data]
+    if not missing:
+        return
+
+    h = homework_table
+    result_json = dict(db.execute(
+        select(h.c.id, h.c.result_json).where(h.c.id.in_(missing))
+    ).all())
+
+    for _, subs in siblings:
+        for i, sub in enumerate(subs):
+            if sub.id in result_json:
+                subs[i] = sub._replace(result_json=result_json[sub.id])
+
+
+# ======================================================
+# ✅ ROW NORMALIZATION
+# ======================================================
+def decode_submission(sub):
+    """
+    Accept agent_analysis_data, fallback to result_json or minimal stats.
+    Payloads with questions come back as homework_decoder.Submission
+    records, which compress_data / report_stats / the report cache read
+    directly.
+    """
+    if sub.agent_analysis_data:
+        return decode_payload(sub.agent_analysis_data)
+    if sub.result_json:
+        return decode_payload(sub.result_json)
+    return {
+        "submission_id": sub.id,
+        "score": sub.score,
+        "percentage": sub.percentage,
+        "grade": sub.grade
+    }
+
+
+def _sibling_mastery(db, siblings):
+    """
+    Mastery index entries of the siblings with homework, in one query.
+    """
+    if not HOMEWORK_CONCEPT_MASTERY:
+        return {}
+    # A missing or unreadable index (e.g. migration 7 not applied) only
+    # drops back to the concepts of the fetched homework; the savepoint
+    # keeps the session usable
+    try:
+        with db.begin_nested():
+            return load_concept_mastery(db, [student.id for student, submissions in siblings if submissions])
+    except Exception:
+        logging.exception("Reading the concept mastery index failed:")
+        return {}
+
+
+def _student_json(submissions, mastery=None):
+    student_json = {"data": [decode_submission(sub) for sub in submissions]}
+    if mastery:
+        student_json["concept_mastery"] = mastery
+    return student_json
+
+
+def collect_student_homework(db, mobile_number, limit=None, extract=HOMEWORK_SERVER_SIDE_EXTRACT,
+                             week=None):
+    """
+    Build {username: {"data": [...]}} for every student on a phone number.
+
+    Returns:
+        (number of students found, all_student_data)
+    """
+    with track_stage("homework_query"):
+        siblings = fetch_sibling_homework(db, mobile_number, limit=limit, extract=extract, week=week)
+        mastery = _sibling_mastery(db, siblings)
+
+    if siblings:
+        print(f"\n📱 Found {len(siblings)} student(s) for {mobile_number}")
+
+    all_student_data = {}
+    with track_stage("json_parse"):
+        for student, submissions in siblings:
+            if not submissions:
+                print(f"⚠️ No homework found for {student.username}")
+                continue
+
+            student_json = _student_json(submissions, mastery.get(student.id))
+            if student_json["data"]:
+                all_student_data[student.username] = student_json
+
+    return len(siblings), all_student_data
+
+
+def collect_bulk_homework(db, mobile_numbers=None, class_name_id=None, section=None,
+                          limit=None, extract=HOMEWORK_SERVER_SIDE_EXTRACT, week=None):
+    """
+    collect_student_homework() for many parents in one query: the given
+    phones, or every parent with a child in the class (and section).
+
+    Returns:
+        {phone: (number of students found, all_student_data)}. Requested
+        phones keep the caller's spelling and order (spellings of the same
+        number are reported once, under the first), unknown ones map to
+        (0, {}); for a class, phones come in student id order.
+    """
+    postgres = db.get_bind().dialect.name == "postgresql"
+
+    def phone_key(phone):
+        # How the query matched the phone: digits on Postgres, exact elsewhere
+        return (normalize_phone(phone) or phone) if postgres else phone
+
+    if mobile_numbers is not None:
+        students = phone_filter(mobile_numbers, normalized=postgres)
+        label = f"{len(mobile_numbers)} phones"
+        requested = {}
+        for phone in mobile_numbers:
+            requested.setdefault(phone_key(phone), phone)
+        results = {phone: [0, {}] for phone in requested.values()}
+    else:
+        students = class_filter(class_name_id, section)
+        label = f"class {class_name_id}" + (f" section {section}" if section else "")
+        requested = None
+        results = {}
+
+    with track_stage("homework_query"):
+        siblings = fetch_students_homework(
+            db, students, limit=limit, extract=extract, week=week, label=label
+        )
+        mastery = _sibling_mastery(db, siblings)
+    print(f"\n📚 Found {len(siblings)} student(s) for {label}")
+
+    with track_stage("json_parse"):
+        for student, submissions in siblings:
+            if requested is not None:
+                phone = requested[phone_key(student.phone_number)]
+            else:
+                phone = student.phone_number
+            entry = results.setdefault(phone, [0, {}])
+            entry[0] += 1
+            if submissions:
+                entry[1][student.username] = _student_json(submissions, mastery.get(student.id))
+
+    return {phone: (count, data) for phone, (count, data) in results.items()}
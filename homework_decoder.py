@@ -0,0 +1,116 @@
+"""
+homework_decoder.py
+-------------------
+Typed fast-path decoder for agent_analysis_data / result_json payloads.
+✅ Compact __slots__ records for submissions and their questions
+✅ orjson when installed, the standard json module otherwise
+✅ Keeps only the fields compress_data / report_stats / the aggregates
+   read — comments, question text and correction notes are dropped right
+   after decoding, and the records are consumed as they are
+✅ Same fallbacks as before: invalid JSON → {"raw_text": ...}, payloads
+   without questions (score-only rows, odd shapes) are passed through whole
+"""
+
+import json
+
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:  # optional speed-up
+    orjson = None
+    _loads = json.loads
+
+JSON_BACKEND = "orjson" if orjson else "json"
+
+
+class Question:
+    __slots__ = ("topic", "total_score", "max_score", "answer_category", "concept_required")
+
+    def __init__(self, topic=None, total_score=None, max_score=None,
+                 answer_category=None, concept_required=None):
+        self.topic = topic
+        self.total_score = total_score
+        self.max_score = max_score
+        self.answer_category = answer_category
+        self.concept_required = concept_required
+
+    @classmethod
+    def from_dict(cls, q):
+        get = q.get
+        return cls(
+            get("topic"),
+            get("total_score"),
+            get("max_score"),
+            get("answer_category"),
+            # compress_data reports a missing concept list as []
+            get("concept_required", []),
+        )
+
+    def to_json(self):
+        return {
+            "topic": self.topic,
+            "total_score": self.total_score,
+            "max_score": self.max_score,
+            "answer_category": self.answer_category,
+            "concept_required": self.concept_required,
+        }
+
+
+class Submission:
+    __slots__ = ("homework_id", "submission_id", "submission_date", "percentage", "questions")
+
+    def __init__(self, homework_id=None, submission_id=None, submission_date=None,
+                 percentage=None, questions=()):
+        self.homework_id = homework_id
+        self.submission_id = submission_id
+        self.submission_date = submission_date
+        self.percentage = percentage
+        self.questions = questions
+
+    def to_json(self):
+        """
+        The trimmed dict the report pipeline consumes.
+        """
+        hw = {
+            "homework_id": self.homework_id,
+            "submission_date": self.submission_date,
+            "question": {"questions": [q.to_json() for q in self.questions]},
+        }
+        if self.submission_id is not None:
+            hw["submission_id"] = self.submission_id
+        if self.percentage is not None:
+            hw["percentage"] = self.percentage
+        return hw
+
+
+def decode_payload(raw):
+    """
+    Decode one analysis payload (str, bytes or an already decoded value).
+
+    Returns:
+        Submission for payloads with question.questions, otherwise the
+        decoded value unchanged ({"raw_text": raw} if it isn't valid JSON)
+    """
+    if isinstance(raw, (str, bytes)):
+        try:
+            raw = _loads(raw)
+        except ValueError:
+            return {"raw_text": raw if isinstance(raw, str) else raw.decode("utf-8", "replace")}
+
+    if not isinstance(raw, dict):
+        return raw
+
+    question = raw.get("question")
+    questions = question.get("questions") if isinstance(question, dict) else None
+    if not questions or not isinstance(questions, list):
+        return raw
+
+    get = raw.get
+    return Submission(
+        get("homework_id"),
+        get("submission_id"),
+        get("submission_date"),
+        get("percentage"),
+        [Question.from_dict(q) for q in questions if isinstance(q, dict)],
+    )
+
@@ -0,0 +1,130 @@
+"""
+idempotency.py
+--------------
+Stored responses for requests sent with an Idempotency-Key header.
+✅ A retry with the same key gets the stored response back — no DB query,
+   no Gemini call
+✅ Same key with a different request body → rejected, not replayed
+✅ Local SQLite file shared by the workers on the host (a retry may land on
+   another worker), bounded by TTL, entry count and total bytes (LRU)
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# ======================================================
+# ✅ IDEMPOTENCY CONFIG
+# ======================================================
+IDEMPOTENCY_DB = os.getenv("IDEMPOTENCY_DB", "idempotency.sqlite3")
+IDEMPOTENCY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", str(24 * 3600)))
+IDEMPOTENCY_MAX_ENTRIES = int(os.getenv("IDEMPOTENCY_MAX_ENTRIES", "5000"))
+IDEMPOTENCY_MAX_BYTES = int(os.getenv("IDEMPOTENCY_MAX_BYTES", str(256 * 1024 * 1024)))
+
+StoredResponse = namedtuple(
+    "StoredResponse", ["fingerprint", "status_code", "media_type", "headers", "body"]
+)
+
+
+def request_fingerprint(scope, payload):
+    """
+    Hash of the endpoint plus the request body it was called with.
+    """
+    encoded = json.dumps([scope, payload], sort_keys=True, default=str)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+class IdempotencyStore:
+    """
+    SQLite table of completed responses, evicted least recently used first.
+    """
+
+    def __init__(self, path=IDEMPOTENCY_DB, ttl=IDEMPOTENCY_TTL_SECONDS,
+                 max_entries=IDEMPOTENCY_MAX_ENTRIES, max_bytes=IDEMPOTENCY_MAX_BYTES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS idempotent_responses (
+                key TEXT PRIMARY KEY,
+                fingerprint TEXT NOT NULL,
+                status_code INTEGER NOT NULL,
+                media_type TEXT,
+                headers TEXT NOT NULL,
+                body BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                expires_at REAL NOT NULL,
+                last_used REAL NOT NULL
+            )
+        """)
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS ix_idempotent_last_used ON idempotent_responses (last_used)"
+        )
+        self._conn.commit()
+
+    def get(self, key):
+        """
+        The stored response for `key`, or None.
+        """
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT fingerprint, status_code, media_type, headers, body "
+                "FROM idempotent_responses WHERE key = ? AND expires_at > ?",
+                (key, now),
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute(
+                "UPDATE idempotent_responses SET last_used = ? WHERE key = ?", (now, key)
+            )
+            self._conn.commit()
+
+        fingerprint, status_code, media_type, headers, body = row
+        return StoredResponse(fingerprint, status_code, media_type, json.loads(headers), bytes(body))
+
+    def set(self, key, response):
+        """
+        Store a StoredResponse, then evict expired and least recently used
+        rows beyond the entry / byte caps.
+        """
+        if len(response.body) > self.max_bytes:
+            return
+
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO idempotent_responses "
+                "(key, fingerprint, status_code, media_type, headers, body, size, expires_at, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, response.fingerprint, response.status_code, response.media_type,
+                 json.dumps(response.headers), response.body, len(response.body),
+                 now + self.ttl, now),
+            )
+            self._conn.execute("DELETE FROM idempotent_responses WHERE expires_at <= ?", (now,))
+            self._conn.execute(
+                "DELETE FROM idempotent_responses WHERE key IN ("
+                "  SELECT key FROM ("
+                "    SELECT key,"
+                "           ROW_NUMBER() OVER (ORDER BY last_used DESC, key) AS position,"
+                "           SUM(size) OVER (ORDER BY last_used DESC, key) AS running_bytes"
+                "    FROM idempotent_responses"
+                "  ) WHERE position > ? OR running_bytes > ?"
+                ")",
+                (self.max_entries, self.max_bytes),
+            )
+            self._conn.commit()
+
+
+idempotency_store = IdempotencyStore()
@@ -0,0 +1,151 @@
+"""
+metrics.py
+----------
+Minimal Prometheus metrics for the report service (text exposition format).
+✅ Per-stage latency histograms: homework_query, json_parse, llm, pdf
+✅ Counters for stage errors, LLM tokens and report cache hits / misses
+✅ Report store lookups: fresh (served), stale or missing
+✅ Count of requests coalesced onto an identical in-flight one
+✅ HTTP request latency per route
+✅ No extra dependency — rendered by hand for GET /metrics
+
+Metrics are per process: with several uvicorn workers, each exposes its own.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+
+# Seconds: from a fast indexed query up to a slow Gemini call
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_registry = []
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {}  # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            series = self._values.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._values.items()):
+                for bound, count in zip(self.buckets, series):
+                    le = _labels(self.labelnames, key, [("le", bound)])
+                    lines.append(f"{self.name}_bucket{le} {count}")
+                le = _labels(self.labelnames, key, [("le", "+Inf")])
+                lines.append(f"{self.name}_bucket{le} {series[-1]}")
+                lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {series[-2]}")
+                lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {series[-1]}")
+        return lines
+
+
+# ======================================================
+# ✅ SERVICE METRICS
+# ======================================================
+stage_seconds = Histogram(
+    "report_stage_seconds", "Latency of each report pipeline stage.", ["stage"]
+)
+stage_errors = Counter(
+    "report_stage_errors_total", "Exceptions raised per report pipeline stage.", ["stage"]
+)
+llm_tokens = Counter(
+    "report_llm_tokens_total", "Gemini tokens used, by prompt / output.", ["kind"]
+)
+cache_requests = Counter(
+    "report_cache_requests_total", "Report cache lookups, by hit / miss.", ["result"]
+)
+store_requests = Counter(
+    "report_store_requests_total", "Pre-generated report lookups, by hit / stale / miss.", ["result"]
+)
+coalesced_requests = Counter(
+    "report_coalesced_requests_total", "Requests that reused an identical in-flight computation.", ["flight"]
+)
+http_request_seconds = Histogram(
+    "http_request_seconds", "HTTP request latency per route.", ["route", "method", "status"]
+)
+
+
+@contextmanager
+def track_stage(stage):
+    """
+    Time a block (or, as a decorator, a function) as one pipeline stage.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        stage_errors.inc(stage=stage)
+        raise
+    finally:
+        stage_seconds.observe(time.perf_counter() - started, stage=stage)
+
+
+def record_llm_usage(response):
+    """
+    Add a Gemini response's usage_metadata to the token counters.
+    """
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return
+    llm_tokens.inc(getattr(usage, "prompt_token_count", 0) or 0, kind="prompt")
+    llm_tokens.inc(getattr(usage, "candidates_token_count", 0) or 0, kind="output")
+
+
+def render_metrics():
+    """
+    All metrics in Prometheus text format.
+    """
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,472 @@
+"""
+migrations.py
+-------------
+Versioned schema changes for the report service's Postgres database.
+✅ Plain SQL steps applied in order, recorded in schema_migrations
+✅ Indexes built with CREATE INDEX CONCURRENTLY — no write lock on the live
+   tables, no statement timeout on the build
+✅ An index left INVALID by an interrupted build is dropped and rebuilt
+✅ `explain` runs EXPLAIN on the endpoint queries and flags sequential scans
+
+The tables themselves belong to the Django app; only indexes, the NOTIFY
+trigger (and the service's own tables) are managed here. Keep tables.py in
+step.
+
+Usage:
+    python migrations.py status
+    python migrations.py migrate
+    python migrations.py explain --mobile-number 7569630144
+    python migrations.py explain --mobile-number 7569630144 --week-start 2025-10-20 --force-index
+"""
+
+import argparse
+import json
+import sys
+from collections import namedtuple
+from datetime import date
+from sqlalchemy import text
+
+Migration = namedtuple("Migration", ["version", "name", "steps"])
+ConcurrentIndex = namedtuple("ConcurrentIndex", ["name", "on"])
+
+# ======================================================
+# ✅ MIGRATIONS (append only — never edit an applied one)
+# ======================================================
+MIGRATIONS = [
+    Migration(1, "hot path indexes", [
+        # Parent lookup: homework_data matches on the digits of phone_number
+        ConcurrentIndex(
+            "ix_student_phone_digits",
+            """"Users_student" (regexp_replace(phone_number, '[^0-9]', '', 'g'))""",
+        ),
+        # Latest-N per student, both match branches
+        ConcurrentIndex("ix_homework_student_name_id_id", "myapp_homeworksubmission (student_name_id, id DESC)"),
+        ConcurrentIndex("ix_homework_student_id_id", "myapp_homeworksubmission (student_id, id DESC)"),
+        # Week windows on submission_date
+        ConcurrentIndex("ix_homework_student_name_date", "myapp_homeworksubmission (student_name_id, submission_date)"),
+        ConcurrentIndex("ix_homework_student_id_date", "myapp_homeworksubmission (student_id, submission_date)"),
+        # Expression indexes need fresh statistics before the planner trusts them
+        'ANALYZE "Users_student"',
+        "ANALYZE myapp_homeworksubmission",
+    ]),
+    Migration(2, "class roster index", [
+        # Bulk reports for a whole class / section
+        ConcurrentIndex("ix_student_class_section", '"Users_student" (class_name_id, section)'),
+    ]),
+    Migration(3, "batch shard leases", [
+        # weekly_batch.py --distributed: nodes claim shards of the parent list
+        """
+        CREATE TABLE IF NOT EXISTS batch_shard_leases (
+            run_id TEXT NOT NULL,
+            shard INTEGER NOT NULL,
+            shard_count INTEGER NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            owner TEXT,
+            lease_expires_at TIMESTAMPTZ,
+            progress_phone TEXT,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            updated_at TIMESTAMPTZ,
+            PRIMARY KEY (run_id, shard)
+        )
+        """,
+    ]),
+    Migration(4, "weekly report store", [
+        # report_store.py: pre-generated reports served by the report endpoints
+        """
+        CREATE TABLE IF NOT EXISTS weekly_report_store (
+            student_id BIGINT NOT NULL,
+            report_window TEXT NOT NULL,
+            username TEXT,
+            watermark BIGINT NOT NULL,
+            report_version TEXT NOT NULL,
+            report TEXT,
+            generated_at TIMESTAMPTZ,
+            PRIMARY KEY (student_id, report_window)
+        )
+        """,
+    ]),
+    Migration(5, "report refresh on new submissions", [
+        # report_refresh.py: dirty students, polling watermark, NOTIFY trigger
+        """
+        CREATE TABLE IF NOT EXISTS report_refresh_dirty (
+            student_id BIGINT PRIMARY KEY,
+            first_dirty_at TIMESTAMPTZ NOT NULL,
+            last_dirty_at TIMESTAMPTZ NOT NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS report_refresh_state (
+            name TEXT PRIMARY KEY,
+            last_submission_id BIGINT NOT NULL
+        )
+        """,
+        """
+        CREATE OR REPLACE FUNCTION notify_homework_submission() RETURNS trigger AS $$
+        BEGIN
+            PERFORM pg_notify('homework_submission', json_build_object(
+                'id', NEW.id,
+                'student_name_id', NEW.student_name_id,
+                'student_id', NEW.student_id
+            )::text);
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql
+        """,
+        "DROP TRIGGER IF EXISTS homework_submission_notify ON myapp_homeworksubmission",
+        """
+        CREATE TRIGGER homework_submission_notify
+        AFTER INSERT ON myapp_homeworksubmission
+        FOR EACH ROW EXECUTE FUNCTION notify_homework_submission()
+        """,
+    ]),
+    Migration(6, "student weekly aggregates", [
+        # weekly_aggregates.py: totals per student and ISO week; its id
+        # watermark lives in report_refresh_state
+        """
+        CREATE TABLE IF NOT EXISTS student_weekly_aggregates (
+            student_id BIGINT NOT NULL,
+            week_start DATE NOT NULL,
+            submissions INTEGER NOT NULL DEFAULT 0,
+            unparsed INTEGER NOT NULL DEFAULT 0,
+            questions INTEGER NOT NULL DEFAULT 0,
+            total_score DOUBLE PRECISION NOT NULL DEFAULT 0,
+            max_score DOUBLE PRECISION NOT NULL DEFAULT 0,
+            correct INTEGER NOT NULL DEFAULT 0,
+            partially_correct INTEGER NOT NULL DEFAULT 0,
+            incorrect INTEGER NOT NULL DEFAULT 0,
+            unattempted INTEGER NOT NULL DEFAULT 0,
+            other_answers INTEGER NOT NULL DEFAULT 0,
+            updated_at TIMESTAMPTZ,
+            PRIMARY KEY (student_id, week_start)
+        )
+        """,
+    ]),
+    Migration(7, "student concept mastery", [
+        # concept_mastery.py: filled by weekly_aggregates.py, own watermark
+        """
+        CREATE TABLE IF NOT EXISTS student_concept_mastery (
+            student_id BIGINT NOT NULL,
+            concept TEXT NOT NULL,
+            attempts INTEGER NOT NULL,
+            total_score DOUBLE PRECISION NOT NULL,
+            max_score DOUBLE PRECISION NOT NULL,
+            decayed_score DOUBLE PRECISION NOT NULL,
+            decayed_max DOUBLE PRECISION NOT NULL,
+            mastery DOUBLE PRECISION,
+            last_seen TIMESTAMP NOT NULL,
+            updated_at TIMESTAMPTZ,
+            PRIMARY KEY (student_id, concept)
+        )
+        """,
+    ]),
+    Migration(8, "report store content marker", [
+        # report_store.py: updated submissions make a stored report stale
+        "ALTER TABLE weekly_report_store ADD COLUMN IF NOT EXISTS content_marker TEXT",
+    ]),
+    Migration(9, "report store mastery watermark", [
+        # report_store.py: reports made before the mastery index caught up go stale
+        "ALTER TABLE weekly_report_store ADD COLUMN IF NOT EXISTS mastery_watermark BIGINT",
+    ]),
+    Migration(10, "submission change queue and weekly aggregate rows", [
+        # Consumers with queue_changes set get the id of every inserted,
+        # updated or deleted submission, so updates and late commits below
+        # their id watermark are folded in again
+        "ALTER TABLE report_refresh_state ADD COLUMN IF NOT EXISTS queue_changes BOOLEAN NOT NULL DEFAULT false",
+        """
+        CREATE TABLE IF NOT EXISTS homework_submission_changes (
+            consumer TEXT NOT NULL,
+            submission_id BIGINT NOT NULL,
+            PRIMARY KEY (consumer, submission_id)
+        )
+        """,
+        """
+        CREATE OR REPLACE FUNCTION queue_homework_submission_change() RETURNS trigger AS $$
+        BEGIN
+            INSERT INTO homework_submission_changes (consumer, submission_id)
+            SELECT name, CASE WHEN TG_OP = 'DELETE' THEN OLD.id ELSE NEW.id END
+            FROM report_refresh_state WHERE queue_changes
+            ON CONFLICT DO NOTHING;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+        """,
+        "DROP TRIGGER IF EXISTS homework_submission_queue ON myapp_homeworksubmission",
+        """
+        CREATE TRIGGER homework_submission_queue
+        AFTER INSERT OR DELETE
+            OR UPDATE OF agent_analysis_data, result_json, submission_date, student_id, student_name_id
+        ON myapp_homeworksubmission
+        FOR EACH ROW EXECUTE FUNCTION queue_homework_submission_change()
+        """,
+        # weekly_aggregates.py: each submission's share of its week, so a
+        # changed submission can be taken back out of the totals
+        """
+        CREATE TABLE IF NOT EXISTS student_weekly_aggregate_rows (
+            submission_id BIGINT PRIMARY KEY,
+            student_id BIGINT NOT NULL,
+            week_start DATE NOT NULL,
+            submissions INTEGER NOT NULL DEFAULT 0,
+            unparsed INTEGER NOT NULL DEFAULT 0,
+            questions INTEGER NOT NULL DEFAULT 0,
+            total_score DOUBLE PRECISION NOT NULL DEFAULT 0,
+            max_score DOUBLE PRECISION NOT NULL DEFAULT 0,
+            correct INTEGER NOT NULL DEFAULT 0,
+            partially_correct INTEGER NOT NULL DEFAULT 0,
+            incorrect INTEGER NOT NULL DEFAULT 0,
+            unattempted INTEGER NOT NULL DEFAULT 0,
+            other_answers INTEGER NOT NULL DEFAULT 0
+        )
+        """,
+        ConcurrentIndex(
+            "ix_weekly_aggregate_rows_student_week", "student_weekly_aggregate_rows (student_id, week_start)"
+        ),
+        # The existing totals have no per-submission rows to retract from:
+        # rebuild them on the next `weekly_aggregates.py update`, with the
+        # queue already on so nothing changed during the rebuild is missed
+        "DELETE FROM student_weekly_aggregates",
+        """
+        INSERT INTO report_refresh_state (name, last_submission_id, queue_changes)
+        VALUES ('weekly_aggregates', 0, true)
+        ON CONFLICT (name) DO UPDATE SET last_submission_id = 0, queue_changes = true
+        """,
+    ]),
+    Migration(11, "concept observations", [
+        # concept_mastery.py: each submission's scores per concept, so a
+        # changed submission can be taken back out of the index
+        """
+        CREATE TABLE IF NOT EXISTS student_concept_observations (
+            submission_id BIGINT NOT NULL,
+            concept TEXT NOT NULL,
+            student_id BIGINT NOT NULL,
+            seen TIMESTAMP NOT NULL,
+            attempts INTEGER NOT NULL,
+            total_score DOUBLE PRECISION NOT NULL,
+            max_score DOUBLE PRECISION NOT NULL,
+            PRIMARY KEY (submission_id, concept)
+        )
+        """,
+        ConcurrentIndex(
+            "ix_concept_observations_student_concept", "student_concept_observations (student_id, concept)"
+        ),
+        # report_store.py: stored reports remember the student's index rows
+        # they quoted (mastery_watermark is no longer read)
+        "ALTER TABLE weekly_report_store ADD COLUMN IF NOT EXISTS mastery_marker TEXT",
+        # Rebuild the index with observations on the next update
+        "DELETE FROM student_concept_mastery",
+        """
+        INSERT INTO report_refresh_state (name, last_submission_id, queue_changes)
+        VALUES ('concept_mastery', 0, true)
+        ON CONFLICT (name) DO UPDATE SET last_submission_id = 0, queue_changes = true
+        """,
+    ]),
+    Migration(12, "notify on updated submissions", [
+        # report_refresh.py: filled-in or corrected analysis wakes the
+        # refresher too (its polling fallback reads the change queue)
+        "DROP TRIGGER IF EXISTS homework_submission_notify ON myapp_homeworksubmission",
+        """
+        CREATE TRIGGER homework_submission_notify
+        AFTER INSERT OR UPDATE OF agent_analysis_data, result_json ON myapp_homeworksubmission
+        FOR EACH ROW EXECUTE FUNCTION notify_homework_submission()
+        """,
+        "UPDATE report_refresh_state SET queue_changes = true WHERE name = 'homework_submission'",
+    ]),
+]
+
+
+def _connect(engine):
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction block
+    conn = engine.connect().execution_options(isolation_level="AUTOCOMMIT")
+    conn.exec_driver_sql("SET statement_timeout = 0")
+    conn.exec_driver_sql("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        )
+    """)
+    return conn
+
+
+def _applied_versions(conn):
+    return {row[0] for row in conn.exec_driver_sql("SELECT version FROM schema_migrations")}
+
+
+def _index_valid(conn, name):
+    """
+    True / False for an existing index, None if there is none.
+    """
+    return conn.execute(
+        text(
+            "SELECT i.indisvalid FROM pg_class c JOIN pg_index i ON i.indexrelid = c.oid "
+            "WHERE c.relname = :name"
+        ),
+        {"name": name},
+    ).scalar()
+
+
+def _create_index(conn, index):
+    if _index_valid(conn, index.name) is False:
+        print(f"♻️  {index.name} is INVALID (interrupted build) — rebuilding")
+        conn.exec_driver_sql(f'DROP INDEX CONCURRENTLY IF EXISTS "{index.name}"')
+    conn.exec_driver_sql(f'CREATE INDEX CONCURRENTLY IF NOT EXISTS "{index.name}" ON {index.on}')
+
+
+# ======================================================
+# ✅ COMMANDS
+# ======================================================
+def migrate(engine):
+    """
+    Apply every pending migration. Steps are idempotent, so a migration that
+    failed halfway can simply be run again.
+    """
+    with _connect(engine) as conn:
+        applied = _applied_versions(conn)
+        pending = [m for m in MIGRATIONS if m.version not in applied]
+        if not pending:
+            print("✅ Schema is up to date")
+            return
+
+        for migration in pending:
+            print(f"🔧 Applying {migration.version}: {migration.name}")
+            for step in migration.steps:
+                if isinstance(step, ConcurrentIndex):
+                    print(f"   ⏳ {step.name}")
+                    _create_index(conn, step)
+                else:
+                    print(f"   ⏳ {step.strip().splitlines()[0][:70]}")
+                    conn.exec_driver_sql(step)
+            conn.execute(
+                text("INSERT INTO schema_migrations (version, name) VALUES (:version, :name)"),
+                {"version": migration.version, "name": migration.name},
+            )
+            print(f"✅ Applied {migration.version}")
+
+
+def status(engine):
+    with _connect(engine) as conn:
+        applied = _applied_versions(conn)
+        for migration in MIGRATIONS:
+            mark = "✅" if migration.version in applied else "⏳"
+            print(f"{mark} {migration.version}: {migration.name}")
+            for step in migration.steps:
+                if isinstance(step, ConcurrentIndex):
+                    valid = _index_valid(conn, step.name)
+                    state = "missing" if valid is None else "valid" if valid else "INVALID"
+                    print(f"     {step.name}: {state}")
+
+
+def _explain_queries(mobile_number, week, class_name_id=None, section=None):
+    """
+    The statements the report endpoints run for one phone number (and, if
+    given, the bulk endpoint for one class / section).
+    """
+    from sqlalchemy import select
+    from tables import students_table
+    from homework_data import _lateral_query, submission_limit, phone_filter, class_filter
+    from report_store import _stored_query, report_window
+    from concept_mastery import _mastery_query
+
+    limit = submission_limit()
+    students = phone_filter([mobile_number])
+    queries = {
+        "report store lookup (latest N)": _stored_query(students, report_window(), None),
+        "sibling homework (latest N)": _lateral_query(students, limit),
+        "sibling homework (server-side extract)": _lateral_query(students, limit, extract=True),
+        "concept mastery lookup": _mastery_query(select(students_table.c.id).where(students)),
+    }
+    if class_name_id is not None:
+        queries["bulk homework (class / section)"] = _lateral_query(
+            class_filter(class_name_id, section), limit
+        )
+    if week:
+        queries["report store lookup (week window)"] = _stored_query(
+            students, report_window(week), week
+        )
+        queries["sibling homework (week window)"] = _lateral_query(
+            students, submission_limit(week=week), week=week
+        )
+    return queries
+
+
+def _seq_scans(plan, found=None):
+    found = [] if found is None else found
+    if "Seq Scan" in plan.get("Node Type", ""):
+        found.append((plan.get("Relation Name"), plan.get("Plan Rows")))
+    for child in plan.get("Plans", []):
+        _seq_scans(child, found)
+    return found
+
+
+def explain(engine, mobile_number, week=None, force_index=False, class_name_id=None, section=None):
+    """
+    EXPLAIN each endpoint query and report sequential scans.
+
+    force_index disables seq scans for the check, so small dev databases —
+    where a seq scan is genuinely cheaper — still show whether an index
+    *can* serve the query.
+
+    Returns:
+        Number of queries with a sequential scan
+    """
+    flagged = 0
+    with engine.begin() as conn:
+        if force_index:
+            conn.exec_driver_sql("SET LOCAL enable_seqscan = off")
+
+        for name, stmt in _explain_queries(mobile_number, week, class_name_id, section).items():
+            compiled = stmt.compile(dialect=conn.dialect, compile_kwargs={"render_postcompile": True})
+            plan = conn.exec_driver_sql(
+                f"EXPLAIN (FORMAT JSON) {compiled}", compiled.params
+            ).scalar()
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            root = plan[0]["Plan"]
+            scans = _seq_scans(root)
+
+            if scans:
+                flagged += 1
+                print(f"⚠️  {name}: cost {root['Total Cost']}")
+                for relation, rows in scans:
+                    print(f"     Seq Scan on {relation} (~{rows} rows)")
+            else:
+                print(f"✅ {name}: cost {root['Total Cost']}, no seq scans")
+
+    return flagged
+
+
+# ======================================================
+# ✅ MAIN
+# ======================================================
+def main():
+    parser = argparse.ArgumentParser(description="Schema migrations for the report service.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("status", help="Show applied migrations and index state")
+    commands.add_parser("migrate", help="Apply pending migrations")
+    explain_cmd = commands.add_parser("explain", help="EXPLAIN the endpoint queries, flag seq scans")
+    explain_cmd.add_argument("--mobile-number", required=True)
+    explain_cmd.add_argument("--week-start", type=date.fromisoformat)
+    explain_cmd.add_argument("--week-end", type=date.fromisoformat)
+    explain_cmd.add_argument("--class-name-id", type=int, help="Also EXPLAIN the bulk class query")
+    explain_cmd.add_argument("--section")
+    explain_cmd.add_argument("--force-index", action="store_true",
+                             help="Disable seq scans to check index coverage on small databases")
+    args = parser.parse_args()
+
+    from database import engine
+    if engine.dialect.name != "postgresql":
+        sys.exit(f"❌ migrations.py targets Postgres, not {engine.dialect.name}")
+
+    if args.command == "migrate":
+        migrate(engine)
+    elif args.command == "status":
+        status(engine)
+    else:
+        from homework_data import week_window
+        week = week_window(args.week_start, args.week_end)
+        if explain(engine, args.mobile_number, week, args.force_index,
+                   args.class_name_id, args.section):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -12,8 +12,10 @@ from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, HRFlowable
 from reportlab.lib.enums import TA_CENTER, TA_LEFT
 from io import BytesIO
 from datetime import datetime
+from metrics import track_stage
 
 
+@track_stage("pdf")
 def create_pdf_report(student_reports: dict) -> BytesIO:
     """
     Generate a PDF from student reports.
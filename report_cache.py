@@ -0,0 +1,157 @@
+"""
+report_cache.py
+---------------
+Content-addressed cache for Gemini weekly reports.
+✅ Key = hash of compress_data(homework) + concept mastery entries +
+   PROMPT_VERSION + MODEL_NAME
+✅ In-memory LRU tier for repeat requests in the same worker
+✅ Persistent SQLite tier shared by workers, with TTL and size cap
+✅ Unchanged homework → report in milliseconds, zero LLM tokens
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dotenv import load_dotenv
+from gemini_weekly_report import compress_data, MODEL_NAME, PROMPT_VERSION
+from homework_decoder import Submission
+
+load_dotenv()
+
+# ======================================================
+# ✅ CACHE CONFIG
+# ======================================================
+REPORT_CACHE_DB = os.getenv("REPORT_CACHE_DB", "report_cache.sqlite3")
+REPORT_CACHE_TTL_SECONDS = int(os.getenv("REPORT_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+REPORT_CACHE_MEMORY_ENTRIES = int(os.getenv("REPORT_CACHE_MEMORY_ENTRIES", "256"))
+REPORT_CACHE_MAX_ENTRIES = int(os.getenv("REPORT_CACHE_MAX_ENTRIES", "10000"))
+
+
+# ======================================================
+# ✅ CACHE KEY
+# ======================================================
+def _is_fallback(hw):
+    # Typed records are hashed by compress_data unless they lost every question
+    if isinstance(hw, Submission):
+        return not hw.questions
+    return not isinstance(hw, dict) or not (hw.get("question") or {}).get("questions")
+
+
+def cache_key(homework_json):
+    """
+    Stable hash of everything the report depends on.
+    """
+    data = homework_json.get("data", [])
+    payload = {
+        "prompt_version": PROMPT_VERSION,
+        "model": MODEL_NAME,
+        "homework": compress_data(homework_json),
+        "concept_mastery": homework_json.get("concept_mastery"),
+        # raw_text / score-only fallbacks have no questions, so hash them whole
+        "fallback": [
+            hw.to_json() if isinstance(hw, Submission) else hw
+            for hw in data if _is_fallback(hw)
+        ],
+    }
+    encoded = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+# ======================================================
+# ✅ TWO-TIER CACHE
+# ======================================================
+class ReportCache:
+    """
+    LRU in front of a SQLite table. Both tiers honour the same TTL.
+    """
+
+    def __init__(self, path=REPORT_CACHE_DB, ttl=REPORT_CACHE_TTL_SECONDS,
+                 memory_entries=REPORT_CACHE_MEMORY_ENTRIES,
+                 max_entries=REPORT_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.memory_entries = memory_entries
+        self.max_entries = max_entries
+        self._memory = OrderedDict()  # key -> (expires_at, report)
+        self._lock = threading.Lock()
+
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS report_cache (
+                key TEXT PRIMARY KEY,
+                report TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                expires_at REAL NOT NULL
+            )
+        """)
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS ix_report_cache_created ON report_cache (created_at)"
+        )
+        self._conn.commit()
+
+    def get(self, key):
+        """
+        Return the cached report for `key`, or None.
+        """
+        now = time.time()
+        with self._lock:
+            hit = self._memory.get(key)
+            if hit is not None:
+                if hit[0] > now:
+                    self._memory.move_to_end(key)
+                    return hit[1]
+                del self._memory[key]
+
+            row = self._conn.execute(
+                "SELECT report, expires_at FROM report_cache WHERE key = ? AND expires_at > ?",
+                (key, now),
+            ).fetchone()
+            if row is None:
+                return None
+
+            self._remember(key, row[1], row[0])
+            return row[0]
+
+    def set(self, key, report):
+        """
+        Store a report in both tiers and evict expired / excess rows.
+        """
+        now = time.time()
+        expires_at = now + self.ttl
+        with self._lock:
+            self._remember(key, expires_at, report)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO report_cache (key, report, created_at, expires_at) "
+                "VALUES (?, ?, ?, ?)",
+                (key, report, now, expires_at),
+            )
+            self._conn.execute("DELETE FROM report_cache WHERE expires_at <= ?", (now,))
+            self._conn.execute(
+                "DELETE FROM report_cache WHERE key IN ("
+                "  SELECT key FROM report_cache ORDER BY created_at DESC LIMIT -1 OFFSET ?"
+                ")",
+                (self.max_entries,),
+            )
+            self._conn.commit()
+
+    def clear(self):
+        """
+        Drop every cached report from both tiers.
+        """
+        with self._lock:
+            self._memory.clear()
+            self._conn.execute("DELETE FROM report_cache")
+            self._conn.commit()
+
+    def _remember(self, key, expires_at, report):
+        self._memory[key] = (expires_at, report)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+
+report_cache = ReportCache()
@@ -0,0 +1,230 @@
+"""
+report_jobs.py
+--------------
+Asynchronous report jobs backed by a durable local queue.
+✅ POST returns a job id immediately; a local worker pool does the work
+✅ Jobs live in SQLite, so queued work survives restarts and is shared by
+   every uvicorn worker on the host
+✅ Atomic claim (BEGIN IMMEDIATE) — each job runs exactly once
+✅ Jobs left "running" by a crashed process are re-queued after a timeout
+✅ Finished txt / PDF results are kept for REPORT_JOB_RETENTION_SECONDS
+✅ Jobs carry the request's week window and submission cap
+"""
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+from dotenv import load_dotenv
+from pdf_generator import create_pdf_report
+from report_pipeline import (
+    build_student_reports, format_txt_report, ReportDataMissing,
+    report_flights, report_request_key,
+)
+
+load_dotenv()
+
+# ======================================================
+# ✅ JOB QUEUE CONFIG
+# ======================================================
+REPORT_JOBS_DB = os.getenv("REPORT_JOBS_DB", "report_jobs.sqlite3")
+REPORT_JOB_WORKERS = int(os.getenv("REPORT_JOB_WORKERS", "2"))
+REPORT_JOB_STALE_SECONDS = int(os.getenv("REPORT_JOB_STALE_SECONDS", "900"))
+REPORT_JOB_RETENTION_SECONDS = int(os.getenv("REPORT_JOB_RETENTION_SECONDS", str(24 * 3600)))
+POLL_SECONDS = 1.0
+
+JOB_FORMATS = {
+    "txt": "text/plain; charset=utf-8",
+    "pdf": "application/pdf",
+}
+
+
+class JobQueue:
+    """
+    SQLite job table plus the worker threads that drain it.
+    """
+
+    def __init__(self, path=REPORT_JOBS_DB, workers=REPORT_JOB_WORKERS):
+        self.path = path
+        self.workers = workers
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS report_jobs (
+                    id TEXT PRIMARY KEY,
+                    format TEXT NOT NULL,
+                    mobile_number TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    started_at REAL,
+                    finished_at REAL,
+                    error TEXT,
+                    error_status INTEGER,
+                    filename TEXT,
+                    result BLOB,
+                    week_start TEXT,
+                    week_end TEXT,
+                    max_submissions INTEGER
+                )
+            """)
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS ix_report_jobs_status "
+                "ON report_jobs (status, created_at)"
+            )
+
+    @contextmanager
+    def _connect(self):
+        # Autocommit; _claim opens its own write transaction
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    # ---------- producer side ----------
+    def submit(self, mobile_number, format="pdf", week=None, limit=None):
+        """
+        Queue a report job and return its id. `week` is a (start, end)
+        window from homework_data.week_window().
+        """
+        job_id = uuid.uuid4().hex
+        week_start, week_end = (bound.isoformat() for bound in week) if week else (None, None)
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO report_jobs (id, format, mobile_number, status, created_at, "
+                "week_start, week_end, max_submissions) "
+                "VALUES (?, ?, ?, 'queued', ?, ?, ?, ?)",
+                (job_id, format, mobile_number, time.time(), week_start, week_end, limit),
+            )
+        self._wakeup.set()
+        return job_id
+
+    def get(self, job_id):
+        """
+        Job row as a dict (including the result bytes), or None.
+        """
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM report_jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    # ---------- worker side ----------
+    def _claim(self):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            # Re-queue work abandoned by a crashed process
+            conn.execute(
+                "UPDATE report_jobs SET status = 'queued', started_at = NULL "
+                "WHERE status = 'running' AND started_at < ?",
+                (now - REPORT_JOB_STALE_SECONDS,),
+            )
+            conn.execute(
+                "DELETE FROM report_jobs WHERE status IN ('done', 'failed') AND finished_at < ?",
+                (now - REPORT_JOB_RETENTION_SECONDS,),
+            )
+            row = conn.execute(
+                "UPDATE report_jobs SET status = 'running', started_at = ? "
+                "WHERE id = (SELECT id FROM report_jobs WHERE status = 'queued' "
+                "            ORDER BY created_at LIMIT 1) "
+                "RETURNING id, format, mobile_number, week_start, week_end, max_submissions",
+                (now,),
+            ).fetchone()
+            conn.execute("COMMIT")
+        return dict(row) if row else None
+
+    def _finish(self, job_id, result=None, filename=None, error=None, error_status=None):
+        status = "failed" if error else "done"
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE report_jobs SET status = ?, finished_at = ?, result = ?, "
+                "filename = ?, error = ?, error_status = ? WHERE id = ?",
+                (status, time.time(), result, filename, error, error_status, job_id),
+            )
+
+    def _work(self):
+        while not self._stop.is_set():
+            try:
+                job = self._claim()
+            except Exception:
+                logging.exception("Could not claim report job:")
+                job = None
+
+            if job is None:
+                self._wakeup.wait(POLL_SECONDS)
+                self._wakeup.clear()
+                continue
+
+            print(f"🧾 Running report job {job['id']} ({job['format']}) for {job['mobile_number']}")
+            try:
+                week = None
+                if job["week_start"]:
+                    week = (datetime.fromisoformat(job["week_start"]),
+                            datetime.fromisoformat(job["week_end"]))
+                result, filename = run_report_job(
+                    job["mobile_number"], job["format"], week=week, limit=job["max_submissions"]
+                )
+                self._finish(job["id"], result=result, filename=filename)
+            except ReportDataMissing as e:
+                self._finish(job["id"], error=e.detail, error_status=404)
+            except Exception as e:
+                logging.exception(f"Report job {job['id']} failed:")
+                self._finish(job["id"], error=str(e), error_status=500)
+
+    def start(self):
+        """
+        Start the worker threads (idempotent).
+        """
+        if self._threads:
+            return
+        self._stop.clear()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"report-job-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+
+# ======================================================
+# ✅ JOB EXECUTION
+# ======================================================
+def run_report_job(mobile_number, format, week=None, limit=None):
+    """
+    Produce the finished report for one job (also used by the PDF endpoint).
+    Identical concurrent calls share one run.
+
+    Returns:
+        (result bytes, download filename)
+    """
+    return report_flights.do(
+        report_request_key(format, mobile_number, week, limit),
+        lambda: _render_report(mobile_number, format, week, limit),
+    )
+
+
+def _render_report(mobile_number, format, week, limit):
+    student_reports = build_student_reports(mobile_number, week=week, limit=limit)
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+
+    if format == "pdf":
+        print("📄 Creating PDF...")
+        return create_pdf_report(student_reports).getvalue(), f"weekly_reports_{timestamp}.pdf"
+
+    return format_txt_report(student_reports).encode("utf-8"), f"weekly_reports_{timestamp}.txt"
+
+
+job_queue = JobQueue()
@@ -0,0 +1,395 @@
+"""
+report_pipeline.py
+------------------
+Runs the Gemini report stage for every student of a request.
+✅ Per-student reports generated concurrently on a shared thread pool
+✅ Global concurrency cap across all requests (REPORT_MAX_CONCURRENCY)
+✅ Per-call Gemini timeout (REPORT_TIMEOUT_SECONDS)
+✅ Reports come back in the same order as the students went in
+✅ Unchanged homework is served from the report cache (report_cache.py)
+✅ Streaming mode yields report chunks per student as Gemini writes them
+✅ build_student_reports(): phone → reports, for callers outside a request;
+   served from the report store (report_store.py) while it is fresh
+✅ report_flights: identical concurrent requests share one computation
+✅ Bulk mode: many parents' reports on the same pool, with their own cap
+   (REPORT_BULK_CONCURRENCY) and failures isolated per phone
+"""
+
+import logging
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from dotenv import load_dotenv
+from gemini_weekly_report import generate_weekly_report, stream_weekly_report
+from report_cache import cache_key, report_cache
+from metrics import cache_requests, store_requests
+from database import SessionLocal
+from homework_data import (
+    collect_student_homework, collect_bulk_homework, normalize_phone, submission_limit,
+)
+from single_flight import SingleFlight
+from report_store import load_stored, fresh_reports, save_reports
+
+load_dotenv()
+
+# ======================================================
+# ✅ CONCURRENCY CONFIG
+# ======================================================
+REPORT_MAX_CONCURRENCY = int(os.getenv("REPORT_MAX_CONCURRENCY", "4"))
+REPORT_TIMEOUT_SECONDS = float(os.getenv("REPORT_TIMEOUT_SECONDS", "60"))
+# Gemini calls one bulk request may have in flight at once; set it below
+# REPORT_MAX_CONCURRENCY to keep slots free for interactive requests
+REPORT_BULK_CONCURRENCY = int(os.getenv("REPORT_BULK_CONCURRENCY", str(REPORT_MAX_CONCURRENCY)))
+REPORT_BULK_MAX_PHONES = int(os.getenv("REPORT_BULK_MAX_PHONES", "500"))
+
+# One pool for the whole process, so the cap holds across concurrent requests
+_executor = ThreadPoolExecutor(
+    max_workers=REPORT_MAX_CONCURRENCY,
+    thread_name_prefix="gemini-report",
+)
+
+# Every Gemini call takes a slot — pool tasks, streams and the streaming
+# fallback (which runs in the request thread) — so the cap covers them all
+_llm_slots = threading.BoundedSemaphore(REPORT_MAX_CONCURRENCY)
+
+
+# ======================================================
+# ✅ REPORT GENERATION
+# ======================================================
+def _generate_and_cache(key, hw_json, timeout):
+    with _llm_slots:
+        report = generate_weekly_report(hw_json, timeout=timeout)
+    report_cache.set(key, report)
+    return report
+
+
+def generate_reports(all_student_data, timeout=REPORT_TIMEOUT_SECONDS):
+    """
+    Generate one Gemini report per student concurrently.
+
+    Args:
+        all_student_data: Dict of {username: homework_json}
+        timeout: Seconds allowed for each Gemini call
+
+    Returns:
+        Dict of {username: report_text} in the input order
+    """
+    student_reports = {}
+    futures = {}
+    for username, hw_json in all_student_data.items():
+        key = cache_key(hw_json)
+        cached = report_cache.get(key)
+        cache_requests.inc(result="hit" if cached is not None else "miss")
+        if cached is not None:
+            print(f"⚡ Cached report for {username}")
+            student_reports[username] = cached
+            continue
+
+        print(f"📝 Generating report for {username}...")
+        futures[username] = _executor.submit(
+            _generate_and_cache, key, hw_json, timeout
+        )
+
+    try:
+        for username, future in futures.items():
+            student_reports[username] = future.result()
+    except Exception:
+        # Don't spend LLM calls on a request that is already failing
+        for future in futures.values():
+            future.cancel()
+        raise
+
+    return {username: student_reports[username] for username in all_student_data}
+
+
+def format_txt_report(student_reports):
+    """
+    Text layout of the weekly_reports_<timestamp>.txt files.
+    """
+    return "".join(
+        f"\n===== 🧮 {username} =====\n{report}\n"
+        for username, report in student_reports.items()
+    )
+
+
+# ======================================================
+# ✅ PHONE → REPORTS
+# ======================================================
+class ReportDataMissing(LookupError):
+    """
+    Nothing to report for a phone number. `students_found` tells apart an
+    unknown phone from students without usable homework.
+    """
+
+    def __init__(self, detail, students_found):
+        super().__init__(detail)
+        self.detail = detail
+        self.students_found = students_found
+
+
+def _load_stored(db, mobile_number, week, limit):
+    # An unreadable store (e.g. migration 4 not applied) only costs a
+    # regeneration; the savepoint keeps the session usable for the fetch
+    try:
+        with db.begin_nested():
+            return load_stored(db, [mobile_number], week, limit)[mobile_number]
+    except Exception:
+        logging.exception("Reading the report store failed:")
+        return None
+
+
+def _store_reports(students, week, limit, reports):
+    # A failed write only costs a regeneration next time
+    if students is None:
+        return
+    db = SessionLocal()
+    try:
+        save_reports(db, students, week, limit, reports)
+        db.commit()
+    except Exception:
+        logging.exception("Saving reports to the report store failed:")
+    finally:
+        db.close()
+
+
+def build_student_reports(mobile_number, week=None, limit=None):
+    """
+    Reports for every student on a phone: straight from the report store if
+    no student has a submission newer than their stored report, otherwise
+    fetch homework, generate and store. The DB session is released before
+    the Gemini stage. `week` / `limit` are passed to collect_student_homework().
+
+    Returns:
+        Dict of {username: report_text}
+    """
+    db = SessionLocal()
+    try:
+        stored = _load_stored(db, mobile_number, week, limit)
+        reports = fresh_reports(stored) if stored is not None else None
+        if reports is None:
+            store_requests.inc(result="stale" if any(s.stored_watermark for s in stored or ()) else "miss")
+            student_count, all_student_data = collect_student_homework(
+                db, mobile_number, limit=limit, week=week
+            )
+    finally:
+        db.close()
+
+    if reports is not None:
+        store_requests.inc(result="hit")
+        print(f"⚡ Stored reports for {mobile_number}")
+        if not reports:
+            raise ReportDataMissing("No valid homework data found for any student.", True)
+        return reports
+
+    if not student_count:
+        raise ReportDataMissing("No students found for this mobile number.", False)
+
+    if not all_student_data:
+        _store_reports(stored, week, limit, {})
+        raise ReportDataMissing("No valid homework data found for any student.", True)
+
+    reports = generate_reports(all_student_data)
+    _store_reports(stored, week, limit, reports)
+    return reports
+
+
+# ======================================================
+# ✅ BULK (MANY PARENTS)
+# ======================================================
+def generate_bulk_reports(bulk_data, timeout=REPORT_TIMEOUT_SECONDS,
+                          concurrency=REPORT_BULK_CONCURRENCY, on_report=None):
+    """
+    Generate reports for many parents, at most `concurrency` Gemini calls at
+    a time. A failure only fails that parent; its remaining students are
+    skipped.
+
+    Args:
+        bulk_data: {phone: {username: homework_json}}
+        on_report: Optional callback(phone, username, report_text), called
+            as each student's report is ready
+
+    Returns:
+        {phone: {"reports": {username: report_text}} or {"error": detail}}
+    """
+    reports = {phone: {} for phone in bulk_data}
+    errors = {}
+    misses = []
+    for phone, students in bulk_data.items():
+        for username, hw_json in students.items():
+            key = cache_key(hw_json)
+            cached = report_cache.get(key)
+            cache_requests.inc(result="hit" if cached is not None else "miss")
+            if cached is not None:
+                reports[phone][username] = cached
+                if on_report:
+                    on_report(phone, username, cached)
+            else:
+                misses.append((phone, username, key, hw_json))
+
+    pending = iter(misses)
+    running = {}
+
+    def submit_next():
+        for phone, username, key, hw_json in pending:
+            if phone in errors:
+                continue
+            print(f"📝 Generating report for {username} ({phone})...")
+            future = _executor.submit(_generate_and_cache, key, hw_json, timeout)
+            running[future] = (phone, username)
+            return
+
+    for _ in range(concurrency):
+        submit_next()
+
+    while running:
+        done, _ = wait(running, return_when=FIRST_COMPLETED)
+        for future in done:
+            phone, username = running.pop(future)
+            try:
+                reports[phone][username] = future.result()
+            except Exception as e:
+                logging.exception(f"Report failed for {username} ({phone}):")
+                errors.setdefault(phone, str(e))
+            else:
+                if on_report:
+                    on_report(phone, username, reports[phone][username])
+            submit_next()
+
+    return {
+        phone: {"error": errors[phone]} if phone in errors
+        else {"reports": {username: reports[phone][username] for username in students}}
+        for phone, students in bulk_data.items()
+    }
+
+
+def build_bulk_reports(mobile_numbers=None, class_name_id=None, section=None,
+                       week=None, limit=None, completed=None, on_report=None):
+    """
+    Phones (or a class / section) → per-phone results, with one homework
+    query for everyone. The DB session is released before the Gemini stage.
+
+    `completed` ({phone: {username: report_text}}) holds reports finished by
+    an earlier run; those students are not sent to Gemini again. `on_report`
+    is passed to generate_bulk_reports().
+
+    Returns:
+        {phone: {"status": "ok", "reports": {...}}
+               | {"status": "not_found" | "no_data" | "error", "detail": ...}}
+    """
+    db = SessionLocal()
+    try:
+        homework = collect_bulk_homework(
+            db, mobile_numbers=mobile_numbers, class_name_id=class_name_id,
+            section=section, limit=limit, week=week,
+        )
+    finally:
+        db.close()
+
+    results = {}
+    for phone, (student_count, all_student_data) in homework.items():
+        if not student_count:
+            results[phone] = {"status": "not_found", "detail": "No students found for this mobile number."}
+        elif not all_student_data:
+            results[phone] = {"status": "no_data", "detail": "No valid homework data found for any student."}
+
+    completed = completed or {}
+    generated = generate_bulk_reports({
+        phone: {
+            username: hw_json for username, hw_json in all_student_data.items()
+            if username not in completed.get(phone, {})
+        }
+        for phone, (_, all_student_data) in homework.items() if phone not in results
+    }, on_report=on_report)
+    for phone, outcome in generated.items():
+        if "error" in outcome:
+            results[phone] = {"status": "error", "detail": outcome["error"]}
+        else:
+            reports = {**completed.get(phone, {}), **outcome["reports"]}
+            results[phone] = {"status": "ok", "reports": {
+                username: reports[username] for username in homework[phone][1]
+            }}
+
+    return {phone: results[phone] for phone in homework}
+
+
+# ======================================================
+# ✅ REQUEST COALESCING
+# ======================================================
+# A double tap or a bot retry joins the request already running
+report_flights = SingleFlight("report")
+
+
+def report_request_key(kind, mobile_number, week=None, limit=None, homework=True):
+    """
+    Identity of a report request for report_flights. `kind` is the output
+    (txt file, pdf, ...); the phone is normalized as the sibling query matches it.
+    """
+    phone = normalize_phone(mobile_number) or mobile_number
+    return (kind, phone, homework, week, submission_limit(limit, week))
+
+
+# ======================================================
+# ✅ STREAMING GENERATION
+# ======================================================
+_STREAM_DONE = object()
+
+
+def _stream_to_queue(key, hw_json, timeout, chunks):
+    # Runs on the pool and holds a slot only while Gemini streams: a slow
+    # client reads the rest off the queue after the slot is released
+    try:
+        parts = []
+        with _llm_slots:
+            for text in stream_weekly_report(hw_json, timeout=timeout):
+                parts.append(text)
+                chunks.put(text)
+        report = "".join(parts).strip()
+        report_cache.set(key, report)
+        return report
+    finally:
+        chunks.put(_STREAM_DONE)
+
+
+def stream_reports(all_student_data, timeout=REPORT_TIMEOUT_SECONDS):
+    """
+    Yield report events student by student, in input order:
+
+        {"event": "start",  "student": ...}
+        {"event": "chunk",  "student": ..., "text": ...}    (repeated)
+        {"event": "report", "student": ..., "text": ..., "fallback": True}
+        {"event": "error",  "student": ..., "detail": ...}
+        {"event": "end",    "student": ..., "cached": bool}
+
+    If the stream fails, the report is regenerated without streaming and sent
+    whole as a "report" event, which replaces any chunks already sent.
+    """
+    for username, hw_json in all_student_data.items():
+        yield {"event": "start", "student": username}
+
+        key = cache_key(hw_json)
+        cached = report_cache.get(key)
+        cache_requests.inc(result="hit" if cached is not None else "miss")
+        if cached is not None:
+            yield {"event": "chunk", "student": username, "text": cached}
+            yield {"event": "end", "student": username, "cached": True}
+            continue
+
+        # Unbounded, but never holds more than one report's text
+        chunks = queue.Queue()
+        future = _executor.submit(_stream_to_queue, key, hw_json, timeout, chunks)
+        try:
+            for text in iter(chunks.get, _STREAM_DONE):
+                yield {"event": "chunk", "student": username, "text": text}
+            future.result()
+        except Exception:
+            logging.exception(f"Stream failed for {username}, falling back:")
+            try:
+                report = _generate_and_cache(key, hw_json, timeout)
+            except Exception as e:
+                logging.exception(f"Fallback failed for {username}:")
+                yield {"event": "error", "student": username, "detail": str(e)}
+                continue
+            yield {"event": "report", "student": username, "text": report, "fallback": True}
+
+        yield {"event": "end", "student": username, "cached": False}
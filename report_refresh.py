@@ -0,0 +1,433 @@
+"""
+report_refresh.py
+-----------------
+Keeps the report store (report_store.py) fresh as homework arrives, so
+reports are regenerated through the week instead of all at report time.
+✅ A trigger on myapp_homeworksubmission sends NOTIFY homework_submission
+   on INSERT and on UPDATE of agent_analysis_data / result_json (migrations
+   5 and 12); the refresher LISTENs and wakes at once
+✅ Polling fallback every REPORT_REFRESH_POLL_SECONDS: new submissions by an
+   id watermark, updated ones from the change queue (migration 10) —
+   nothing is lost while the listener is down
+✅ Affected students are marked dirty in report_refresh_dirty; a student is
+   regenerated once submissions stop for REPORT_REFRESH_DEBOUNCE_SECONDS
+   (at the latest REPORT_REFRESH_MAX_DELAY_SECONDS after the first one)
+✅ One active refresher per database (advisory lock); extra ones stand by
+
+The store's own watermark check still decides what is served — the
+refresher only makes sure the next request finds a fresh report.
+
+Usage:
+    python report_refresh.py run
+    python report_refresh.py status
+"""
+
+import argparse
+import json
+import logging
+import os
+import select as selectors
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from dotenv import load_dotenv
+from sqlalchemy import select, delete, update, func, union, or_
+from sqlalchemy.dialects import postgresql, sqlite
+
+from database import engine
+from tables import (
+    students_table, homework_table, refresh_dirty_table, refresh_state_table, submission_changes_table,
+)
+from homework_data import normalize_phone
+from report_pipeline import build_student_reports, ReportDataMissing
+
+load_dotenv()
+
+# ======================================================
+# ✅ REFRESH CONFIG
+# ======================================================
+REPORT_REFRESH_DEBOUNCE_SECONDS = int(os.getenv("REPORT_REFRESH_DEBOUNCE_SECONDS", "300"))
+REPORT_REFRESH_MAX_DELAY_SECONDS = int(os.getenv("REPORT_REFRESH_MAX_DELAY_SECONDS", "3600"))
+REPORT_REFRESH_POLL_SECONDS = int(os.getenv("REPORT_REFRESH_POLL_SECONDS", "60"))
+REPORT_REFRESH_WORKERS = int(os.getenv("REPORT_REFRESH_WORKERS", "2"))
+REPORT_REFRESH_BATCH = int(os.getenv("REPORT_REFRESH_BATCH", "100"))    # students per round
+REPORT_REFRESH_SCAN_BATCH = 5000                                        # submissions per scan step
+
+CHANNEL = "homework_submission"
+_WATERMARK = "homework_submission"
+_LEADER_LOCK = "report_refresh"
+_TICK_SECONDS = 5
+
+
+def _now():
+    return datetime.now(timezone.utc)
+
+
+def _insert(conn, table):
+    dialect = postgresql if conn.dialect.name == "postgresql" else sqlite
+    return dialect.insert(table)
+
+
+# ======================================================
+# ✅ DIRTY STUDENTS
+# ======================================================
+def _matching_students(submissions):
+    """
+    Student ids of a set of homework rows (by FK or by username).
+    """
+    s = students_table
+    return union(
+        select(s.c.id).join(submissions, submissions.c.student_name_id == s.c.id),
+        select(s.c.id).join(submissions, submissions.c.student_id == s.c.username),
+    )
+
+
+def mark_dirty(conn, student_ids, now=None):
+    """
+    Flag students for regeneration. A student already dirty keeps its
+    first_dirty_at (the max-delay clock) and gets a new last_dirty_at
+    (the debounce clock).
+    """
+    student_ids = sorted(set(student_ids))
+    if not student_ids:
+        return 0
+    now = now or _now()
+    d = refresh_dirty_table
+    stmt = _insert(conn, d).values([
+        {"student_id": sid, "first_dirty_at": now, "last_dirty_at": now} for sid in student_ids
+    ])
+    conn.execute(stmt.on_conflict_do_update(
+        index_elements=[d.c.student_id], set_={"last_dirty_at": stmt.excluded.last_dirty_at},
+    ))
+    return len(student_ids)
+
+
+def mark_notified(conn, payloads):
+    """
+    Mark the students named by NOTIFY payloads (new or updated
+    submissions). Covers a submission that commits after a higher id was
+    already scanned.
+    """
+    fks = {p["student_name_id"] for p in payloads if p.get("student_name_id") is not None}
+    usernames = {p["student_id"] for p in payloads if p.get("student_id")}
+    if not fks and not usernames:
+        return 0
+    s = students_table
+    ids = conn.execute(
+        select(s.c.id).where(or_(s.c.id.in_(fks), s.c.username.in_(usernames)))
+    ).scalars().all()
+    return mark_dirty(conn, ids)
+
+
+def scan_new_submissions(conn):
+    """
+    Mark the students of every submission past the stored id watermark and
+    advance it, then those of every submission queued as changed. The
+    first scan only records the current newest id and turns the queue on.
+
+    Returns:
+        Number of students marked
+    """
+    st, h = refresh_state_table, homework_table
+    state = conn.execute(
+        select(st.c.last_submission_id, st.c.queue_changes).where(st.c.name == _WATERMARK)
+    ).first()
+    if state is None:
+        newest = conn.execute(select(func.max(h.c.id))).scalar() or 0
+        conn.execute(_insert(conn, st).values(name=_WATERMARK, last_submission_id=newest, queue_changes=True)
+                     .on_conflict_do_nothing())
+        return 0
+    if not state.queue_changes:
+        # A watermark recorded before migration 10
+        conn.execute(update(st).where(st.c.name == _WATERMARK).values(queue_changes=True))
+
+    marked = 0
+    last_id = state.last_submission_id
+    while True:
+        batch = (
+            select(h.c.id, h.c.student_name_id, h.c.student_id)
+            .where(h.c.id > last_id)
+            .order_by(h.c.id)
+            .limit(REPORT_REFRESH_SCAN_BATCH)
+            .subquery("new_submissions")
+        )
+        upto = conn.execute(select(func.max(batch.c.id))).scalar()
+        if upto is None:
+            break
+        marked += mark_dirty(conn, conn.execute(_matching_students(batch)).scalars().all())
+        conn.execute(update(st).where(st.c.name == _WATERMARK).values(last_submission_id=upto))
+        last_id = upto
+    return marked + scan_changed_submissions(conn)
+
+
+def scan_changed_submissions(conn):
+    """
+    Mark the students of submissions from the refresher's change queue
+    (updated analysis, results, dates or students) and clear them from it.
+
+    Returns:
+        Number of students marked
+    """
+    q, h = submission_changes_table, homework_table
+    marked = 0
+    while True:
+        queued = (
+            select(q.c.submission_id).where(q.c.consumer == _WATERMARK)
+            .limit(REPORT_REFRESH_SCAN_BATCH)
+        )
+        ids = conn.execute(
+            delete(q).where(q.c.consumer == _WATERMARK, q.c.submission_id.in_(queued))
+            .returning(q.c.submission_id)
+        ).scalars().all()
+        if not ids:
+            return marked
+        changed = (
+            select(h.c.id, h.c.student_name_id, h.c.student_id)
+            .where(h.c.id.in_(ids))
+            .subquery("changed_submissions")
+        )
+        marked += mark_dirty(conn, conn.execute(_matching_students(changed)).scalars().all())
+
+
+def due_students(conn, now=None, limit=REPORT_REFRESH_BATCH):
+    """
+    Dirty students whose debounce (or max delay) has run out, with their
+    phone: [(student_id, phone_number, last_dirty_at)].
+    """
+    now = now or _now()
+    d, s = refresh_dirty_table, students_table
+    return conn.execute(
+        select(d.c.student_id, s.c.phone_number, d.c.last_dirty_at)
+        .join(s, s.c.id == d.c.student_id)
+        .where(or_(
+            d.c.last_dirty_at <= now - timedelta(seconds=REPORT_REFRESH_DEBOUNCE_SECONDS),
+            d.c.first_dirty_at <= now - timedelta(seconds=REPORT_REFRESH_MAX_DELAY_SECONDS),
+        ))
+        .order_by(d.c.first_dirty_at)
+        .limit(limit)
+    ).all()
+
+
+# ======================================================
+# ✅ REFRESHER
+# ======================================================
+class ReportRefresher:
+    """
+    LISTEN + poll loop that regenerates dirty students' reports.
+    """
+
+    def __init__(self, workers=REPORT_REFRESH_WORKERS, poll_seconds=REPORT_REFRESH_POLL_SECONDS):
+        self.poll_seconds = poll_seconds
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="report-refresh")
+        self._stop = threading.Event()
+        self._listener = None
+
+    # ---------- LISTEN connection (Postgres only) ----------
+    def _listen(self):
+        """
+        Open the LISTEN connection and take the leader lock on it. Returns
+        False while another refresher holds the lock.
+        """
+        raw = engine.raw_connection()
+        try:
+            conn = raw.driver_connection
+            conn.autocommit = True
+            with conn.cursor() as cur:
+                cur.execute("SET statement_timeout = 0")
+                cur.execute("SELECT pg_try_advisory_lock(hashtext(%s))", (_LEADER_LOCK,))
+                if not cur.fetchone()[0]:
+                    raw.invalidate()  # session settings changed; keep it out of the pool
+                    return False
+                cur.execute(f"LISTEN {CHANNEL}")
+        except Exception:
+            raw.invalidate()
+            raise
+        self._listener = raw
+        print(f"👂 Listening on {CHANNEL}")
+        return True
+
+    def _lead(self):
+        """
+        Block until this refresher holds the leader lock and LISTENs.
+        """
+        while not self._stop.is_set():
+            try:
+                if self._listen():
+                    return
+                print("⏸️  Another refresher is active — standing by")
+            except Exception:
+                logging.exception("Could not open the LISTEN connection:")
+            self._stop.wait(self.poll_seconds)
+
+    def _check_listener(self):
+        # A dead socket does not always wake select(); probe it each poll
+        try:
+            with self._listener.driver_connection.cursor() as cur:
+                cur.execute("SELECT 1")
+        except Exception:
+            logging.exception("LISTEN connection lost:")
+            self._drop_listener()
+
+    def _drop_listener(self):
+        if self._listener is not None:
+            # Invalidate: the session (lock, LISTEN) must not go back to the pool
+            self._listener.invalidate()
+            self._listener = None
+
+    def _wait(self, timeout):
+        """
+        Sleep up to `timeout`, waking on a notification. Returns the
+        notification payloads received.
+        """
+        if self._listener is None:
+            self._stop.wait(timeout)
+            return []
+
+        conn = self._listener.driver_connection
+        payloads = []
+        try:
+            if not conn.notifies and selectors.select([conn], [], [], timeout) != ([], [], []):
+                conn.poll()
+            while conn.notifies:
+                try:
+                    payloads.append(json.loads(conn.notifies.pop(0).payload))
+                except ValueError:
+                    pass
+        except Exception:
+            logging.exception("LISTEN connection lost:")
+            self._drop_listener()
+        return payloads
+
+    # ---------- regeneration ----------
+    def _regenerate(self, phone):
+        try:
+            build_student_reports(phone)
+            return True
+        except ReportDataMissing:
+            return True
+        except Exception:
+            logging.exception(f"Refreshing reports for {phone} failed:")
+            return False
+
+    def refresh_due(self):
+        """
+        Regenerate every due student's phone (siblings share a report
+        request), then clear them — unless new homework arrived meanwhile.
+
+        Returns:
+            Number of phones refreshed
+        """
+        with engine.begin() as conn:
+            due = due_students(conn)
+        if not due:
+            return 0
+
+        phones = {}
+        for student_id, phone, last_dirty_at in due:
+            key = normalize_phone(phone) or phone or ""
+            phones.setdefault(key, (phone, []))[1].append((student_id, last_dirty_at))
+
+        results = dict(zip(
+            phones, self._executor.map(lambda item: self._regenerate(item[0]), phones.values())
+        ))
+
+        d = refresh_dirty_table
+        with engine.begin() as conn:
+            for key, (_, students) in phones.items():
+                for student_id, last_dirty_at in students:
+                    if results[key]:
+                        conn.execute(delete(d).where(
+                            (d.c.student_id == student_id) & (d.c.last_dirty_at == last_dirty_at)
+                        ))
+                    else:
+                        # Back off one debounce period before retrying. Both
+                        # clocks restart, or a student past the max delay
+                        # would be retried on every tick
+                        now = _now()
+                        conn.execute(update(d).where(d.c.student_id == student_id)
+                                     .values(first_dirty_at=now, last_dirty_at=now))
+        print(f"🔄 Refreshed {sum(results.values())}/{len(phones)} phones")
+        return len(phones)
+
+    # ---------- main loop ----------
+    def scan(self, payloads=()):
+        with engine.begin() as conn:
+            notified = mark_notified(conn, payloads) if payloads else 0
+            scanned = scan_new_submissions(conn)
+        if notified or scanned:
+            print(f"📝 Marked dirty: {notified} notified, {scanned} from new or changed submissions")
+
+    def stop(self):
+        self._stop.set()
+
+    def run(self):
+        """
+        On Postgres the loop only runs while holding the leader lock; a lost
+        LISTEN connection also loses the lock, so it is re-taken first.
+        Elsewhere (SQLite fixtures) it just polls.
+        """
+        postgres = engine.dialect.name == "postgresql"
+        next_scan = 0.0
+        try:
+            while not self._stop.is_set():
+                if postgres and self._listener is None:
+                    self._lead()
+                    next_scan = 0.0
+                    continue
+
+                if time.monotonic() >= next_scan:
+                    if postgres:
+                        self._check_listener()
+                    self.scan()
+                    next_scan = time.monotonic() + self.poll_seconds
+
+                self.refresh_due()
+
+                timeout = max(0.0, min(next_scan - time.monotonic(), _TICK_SECONDS))
+                payloads = self._wait(timeout)
+                if payloads:
+                    self.scan(payloads)
+        finally:
+            self._drop_listener()
+            self._executor.shutdown(wait=True)
+
+
+def status():
+    d, st = refresh_dirty_table, refresh_state_table
+    with engine.connect() as conn:
+        watermark = conn.execute(
+            select(st.c.last_submission_id).where(st.c.name == _WATERMARK)
+        ).scalar()
+        q = submission_changes_table
+        queued = conn.execute(select(func.count()).where(q.c.consumer == _WATERMARK)).scalar()
+        dirty, oldest = conn.execute(select(func.count(), func.min(d.c.first_dirty_at))).one()
+        due = len(due_students(conn, limit=None))
+    print(f"🔖 Submission watermark: {watermark}, {queued} changed submission(s) queued")
+    print(f"📝 Dirty students: {dirty} ({due} due), oldest since {oldest}")
+
+
+# ======================================================
+# ✅ MAIN
+# ======================================================
+def main():
+    parser = argparse.ArgumentParser(description="Refresh stored reports as homework arrives.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("run", help="Listen for new and updated submissions and refresh reports")
+    commands.add_parser("status", help="Show the watermark and dirty students")
+    args = parser.parse_args()
+
+    if args.command == "status":
+        status()
+        return
+
+    print("📘 SmartLearners.ai – Report Refresher\n")
+    refresher = ReportRefresher()
+    try:
+        refresher.run()
+    except KeyboardInterrupt:
+        refresher.stop()
+
+
+if __name__ == "__main__":
+    main()
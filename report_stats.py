@@ -0,0 +1,196 @@
+"""
+report_stats.py
+---------------
+Deterministic weekly statistics computed locally from homework JSON.
+✅ Exact average percentage, answer-category counts and trend
+✅ Per-concept earned/max totals → strongest and weakest concepts, or the
+   student's mastery index entries when homework_data attached them
+✅ One flattening pass over question.questions[*] (typed records from
+   homework_decoder.py or plain dicts), then column-wise sums
+✅ Gemini only receives these numbers and writes the narrative
+"""
+
+from collections import Counter, defaultdict
+from homework_decoder import Submission
+
+TREND_THRESHOLD = 5.0  # percentage points between earlier and later homework
+TOP_CONCEPTS = 5
+STRONG_THRESHOLD = 50.0  # concept percentage separating strengths from weak areas
+
+
+def _number(value):
+    """
+    Coerce a score field (int, float, Decimal, numeric string, None) to float.
+    """
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _percent(earned, possible):
+    return round(earned * 100.0 / possible, 1) if possible else None
+
+
+def _flatten(homework_json):
+    """
+    Flatten all questions into parallel columns, plus one entry per homework.
+    """
+    scores, maxes, categories, concepts, owners = [], [], [], [], []
+    homeworks = []
+    unparsed = 0
+
+    for hw in homework_json.get("data", []):
+        if isinstance(hw, Submission):
+            # Typed records from homework_decoder.py
+            if not hw.questions and hw.percentage is None:
+                unparsed += 1
+                continue
+            homeworks.append({
+                "homework_id": hw.homework_id or hw.submission_id,
+                "date": (hw.submission_date or "")[:10],
+                "percentage": hw.percentage,
+            })
+            index = len(homeworks) - 1
+            for q in hw.questions:
+                scores.append(_number(q.total_score))
+                maxes.append(_number(q.max_score))
+                categories.append(q.answer_category or "Unknown")
+                concepts.append(q.concept_required or [])
+                owners.append(index)
+            continue
+
+        if not isinstance(hw, dict):
+            unparsed += 1
+            continue
+
+        questions = (hw.get("question") or {}).get("questions") or []
+        if not questions and "percentage" not in hw:
+            unparsed += 1
+            continue
+
+        homeworks.append({
+            "homework_id": hw.get("homework_id") or hw.get("submission_id"),
+            "date": (hw.get("submission_date") or "")[:10],
+            # score-only fallback rows carry a precomputed percentage
+            "percentage": hw.get("percentage"),
+        })
+        index = len(homeworks) - 1
+
+        for q in questions:
+            scores.append(_number(q.get("total_score")))
+            maxes.append(_number(q.get("max_score")))
+            categories.append(q.get("answer_category") or "Unknown")
+            concepts.append(q.get("concept_required") or [])
+            owners.append(index)
+
+    return scores, maxes, categories, concepts, owners, homeworks, unparsed
+
+
+def _trend(percentages):
+    if len(percentages) < 2:
+        return "not enough data"
+    # Mean of the later half vs the earlier half, so one outlier can't flip it
+    half = len(percentages) // 2
+    earlier, later = percentages[:half], percentages[-half:]
+    change = sum(later) / half - sum(earlier) / half
+    if change > TREND_THRESHOLD:
+        return "improving"
+    if change < -TREND_THRESHOLD:
+        return "declining"
+    return "consistent"
+
+
+def _window_concepts(concepts, scores, maxes, top_k):
+    """
+    Concept mastery from the given homework only: earned / max over every
+    question that required the concept.
+    """
+    concept_earned = defaultdict(float)
+    concept_possible = defaultdict(float)
+    for required, score, max_score in zip(concepts, scores, maxes):
+        if isinstance(required, str):
+            required = [required]
+        for concept in required:
+            concept_earned[concept] += score
+            concept_possible[concept] += max_score
+
+    concept_scores = sorted(
+        (
+            (_percent(concept_earned[c], concept_possible[c]), c)
+            for c in concept_possible if concept_possible[c]
+        ),
+        key=lambda item: (-item[0], item[1]),
+    )
+    strong = [{"concept": c, "percentage": p} for p, c in concept_scores[:top_k] if p >= STRONG_THRESHOLD]
+    weak = [{"concept": c, "percentage": p} for p, c in reversed(concept_scores[-top_k:]) if p < STRONG_THRESHOLD]
+    return strong, weak
+
+
+def compute_homework_stats(homework_json, top_k=TOP_CONCEPTS):
+    """
+    Compute the figures the weekly report quotes.
+
+    Args:
+        homework_json: {"data": [submission, ...]} as built by homework_data.py,
+            optionally with "concept_mastery" from the mastery index
+        top_k: Number of strong / weak concepts to return
+
+    Returns:
+        Dict of exact statistics, safe to json.dumps into a prompt
+    """
+    scores, maxes, categories, concepts, owners, homeworks, unparsed = _flatten(homework_json)
+
+    # Per-homework totals from the owner column
+    hw_earned = [0.0] * len(homeworks)
+    hw_possible = [0.0] * len(homeworks)
+    for owner, score, max_score in zip(owners, scores, maxes):
+        hw_earned[owner] += score
+        hw_possible[owner] += max_score
+
+    for hw, earned, possible in zip(homeworks, hw_earned, hw_possible):
+        if possible:
+            hw["percentage"] = _percent(earned, possible)
+        elif hw["percentage"] is not None:
+            hw["percentage"] = round(_number(hw["percentage"]), 1)
+
+    # Rows arrive newest first; report them oldest → newest
+    chronological = list(reversed(homeworks))
+    if all(hw["date"] for hw in chronological):
+        chronological.sort(key=lambda hw: hw["date"])
+    percentages = [hw["percentage"] for hw in chronological if hw["percentage"] is not None]
+
+    total_earned = sum(scores)
+    total_possible = sum(maxes)
+    if total_possible:
+        average = _percent(total_earned, total_possible)
+    elif percentages:
+        average = round(sum(percentages) / len(percentages), 1)
+    else:
+        average = None
+
+    mastery = homework_json.get("concept_mastery")
+    if mastery:
+        # Decayed mastery over all of the student's homework (concept_mastery.py)
+        strong, weak = mastery["strong_concepts"][:top_k], mastery["weak_concepts"][:top_k]
+        concepts_from = "mastery_index"
+    else:
+        strong, weak = _window_concepts(concepts, scores, maxes, top_k)
+        concepts_from = "these_homeworks"
+
+    return {
+        "homeworks_analyzed": len(homeworks),
+        "unparsed_submissions": unparsed,
+        "questions": len(scores),
+        "total_score": total_earned,
+        "max_score": total_possible,
+        "average_percentage": average,
+        "answer_categories": dict(Counter(categories).most_common()),
+        "homework_percentages": [
+            {"date": hw["date"], "percentage": hw["percentage"]} for hw in chronological
+        ],
+        "trend": _trend(percentages),
+        "concepts_from": concepts_from,
+        "strong_concepts": strong,
+        "weak_concepts": weak,
+    }
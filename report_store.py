@@ -0,0 +1,223 @@
+"""
+report_store.py
+---------------
+Pre-generated weekly reports, served without fetching homework or calling
+Gemini.
+✅ One row per (student, report window): the report, the prompt / model
+   version, the newest submission id it covers (the watermark) and a
+   content marker of the submissions it was generated from
+✅ Freshness check and stored reports come from one indexed query: a report
+   is served only while the student has no newer submission in its window
+   and none of the window's submissions has been updated since
+✅ Reports quoting the concept mastery index remember a marker of the
+   student's index rows; one generated before the index folded in its new
+   or corrected submissions goes stale once the index catches up
+✅ Filled ahead of time by `weekly_batch.py --pregenerate`, and by every
+   on-demand report
+✅ Table lives in the service database (migrations.py / tables.py)
+"""
+
+from collections import namedtuple
+from datetime import datetime, timezone
+from sqlalchemy import select, func, and_, cast, literal_column, BigInteger, Text
+from sqlalchemy.dialects import postgresql, sqlite
+
+from tables import students_table, homework_table, report_store_table
+from homework_data import (
+    phone_filter, normalize_phone, submission_limit, _in_week, _newest_first, HOMEWORK_CONCEPT_MASTERY,
+)
+from concept_mastery import mastery_marker
+from gemini_weekly_report import PROMPT_VERSION, MODEL_NAME
+
+# A new prompt or model makes every stored report stale
+REPORT_VERSION = f"{PROMPT_VERSION}:{MODEL_NAME}"
+
+StoredStudent = namedtuple(
+    "StoredStudent",
+    ["student_id", "username", "phone", "watermark", "stored_watermark", "marker", "stored_marker",
+     "mastery_marker", "stored_mastery_marker", "report_version", "report"],
+)
+
+
+def report_window(week=None, limit=None):
+    """
+    Store key of a request's window: the latest-N default or a dated week,
+    with its per-student submission cap.
+    """
+    limit = submission_limit(limit, week)
+    if not week:
+        return f"latest:{limit}"
+    return f"{week[0].date().isoformat()}_{week[1].date().isoformat()}:{limit}"
+
+
+def is_fresh(student):
+    """
+    True if the stored report covers the student's newest submission and
+    the window's submissions are unchanged since (or the student has
+    nothing to report in the window).
+    """
+    if student.watermark is None:
+        return True
+    return (student.stored_watermark == student.watermark
+            and student.stored_marker == student.marker
+            and student.report_version == REPORT_VERSION
+            and _mastery_covered(student))
+
+
+def _mastery_covered(student):
+    # The student's index rows change only when the index folds in one of
+    # their new or changed submissions: a report made while it lagged is
+    # kept until then — regenerating earlier would quote the same concepts
+    if not HOMEWORK_CONCEPT_MASTERY:
+        return True
+    return student.stored_mastery_marker == student.mastery_marker
+
+
+# ======================================================
+# ✅ LOOKUP
+# ======================================================
+def _newest_submission(match, week):
+    # max(id) off the (student, id) / (student, submission_date) indexes
+    h = homework_table
+    stmt = select(func.max(h.c.id)).where(match)
+    if week:
+        stmt = stmt.where(_in_week(h, week))
+    return stmt.scalar_subquery()
+
+
+def _row_marker(h, postgres):
+    if postgres:
+        # xmin (the row's inserting / last updating transaction) changes on
+        # every UPDATE, and reading it doesn't touch the payload columns
+        return cast(cast(literal_column(f"{h.name}.xmin"), Text), BigInteger)
+    # SQLite has no row version; payload lengths are good enough for fixtures
+    return (func.length(func.coalesce(h.c.agent_analysis_data, ""))
+            + func.length(func.coalesce(h.c.result_json, "")))
+
+
+def _window_marker(match, week, limit, postgres):
+    # Summed row markers of the submissions the report is generated from —
+    # the same newest-first window the homework fetch reads
+    h = homework_table
+    stmt = select(_row_marker(h, postgres).label("marker")).where(match)
+    if week:
+        stmt = stmt.where(_in_week(h, week))
+    window = stmt.order_by(*_newest_first(h.c, week)).limit(limit).correlate(students_table).subquery()
+    return select(func.sum(window.c.marker)).scalar_subquery()
+
+
+def _stored_query(students, window, week, limit=None, postgres=True):
+    s, h, r = students_table, homework_table, report_store_table
+    limit = submission_limit(limit, week)
+    mastery_rows, mastery_updated = mastery_marker(s.c.id)
+    return (
+        select(
+            s.c.id, s.c.username, s.c.phone_number,
+            _newest_submission(h.c.student_name_id == s.c.id, week).label("wm_fk"),
+            _newest_submission(h.c.student_id == s.c.username, week).label("wm_username"),
+            _window_marker(h.c.student_name_id == s.c.id, week, limit, postgres).label("mk_fk"),
+            _window_marker(h.c.student_id == s.c.username, week, limit, postgres).label("mk_username"),
+            mastery_rows.label("mastery_rows"), mastery_updated.label("mastery_updated"),
+            r.c.watermark, r.c.content_marker, r.c.mastery_marker, r.c.report_version, r.c.report,
+        )
+        .select_from(
+            s.outerjoin(r, and_(r.c.student_id == s.c.id, r.c.report_window == window))
+        )
+        .where(students)
+        .order_by(s.c.id)
+    )
+
+
+def load_stored(db, mobile_numbers, week=None, limit=None):
+    """
+    Every student on the given phones with their newest submission id,
+    content marker and stored report, in one query.
+
+    Returns:
+        {phone: [StoredStudent, ...]} keyed and matched like
+        collect_bulk_homework() (digits on Postgres, exact elsewhere)
+    """
+    postgres = db.get_bind().dialect.name == "postgresql"
+
+    def phone_key(phone):
+        return (normalize_phone(phone) or phone) if postgres else phone
+
+    requested = {}
+    for phone in mobile_numbers:
+        requested.setdefault(phone_key(phone), phone)
+    stored = {phone: [] for phone in requested.values()}
+
+    rows = db.execute(_stored_query(
+        phone_filter(mobile_numbers, normalized=postgres), report_window(week, limit), week,
+        limit, postgres,
+    )).all()
+    for row in rows:
+        phone = requested.get(phone_key(row.phone_number))
+        if phone is None:
+            continue
+        watermarks = [w for w in (row.wm_fk, row.wm_username) if w is not None]
+        stored[phone].append(StoredStudent(
+            row.id, row.username, row.phone_number, max(watermarks, default=None),
+            row.watermark, f"{row.mk_fk}/{row.mk_username}", row.content_marker,
+            f"{row.mastery_rows}/{row.mastery_updated}", row.mastery_marker, row.report_version, row.report,
+        ))
+    return stored
+
+
+def fresh_reports(students):
+    """
+    {username: report} if every student's stored report is fresh, else
+    None. Students without submissions in the window have no report;
+    {} means nobody on the phone has anything to report.
+    """
+    if not students or not all(is_fresh(student) for student in students):
+        return None
+    return {
+        student.username: student.report for student in students
+        if student.watermark is not None and student.report is not None
+    }
+
+
+# ======================================================
+# ✅ SAVE
+# ======================================================
+def save_reports(db, students, week, limit, reports):
+    """
+    Store the reports generated for `students` (as returned by
+    load_stored(), i.e. with the watermarks read *before* the homework
+    fetch — a submission landing meanwhile only makes the row stale early).
+    Students with submissions but no report are stored with report NULL.
+    A row is never replaced by one with an older watermark.
+    """
+    r = report_store_table
+    window = report_window(week, limit)
+    now = datetime.now(timezone.utc)
+    rows = [
+        {
+            "student_id": student.student_id,
+            "report_window": window,
+            "username": student.username,
+            "watermark": student.watermark,
+            "content_marker": student.marker,
+            "mastery_marker": student.mastery_marker,
+            "report_version": REPORT_VERSION,
+            "report": reports.get(student.username),
+            "generated_at": now,
+        }
+        for student in students if student.watermark is not None
+    ]
+    if not rows:
+        return
+
+    dialect = postgresql if db.get_bind().dialect.name == "postgresql" else sqlite
+    stmt = dialect.insert(r).values(rows)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[r.c.student_id, r.c.report_window],
+        set_={
+            column: stmt.excluded[column]
+            for column in ("username", "watermark", "content_marker", "mastery_marker",
+                           "report_version", "report", "generated_at")
+        },
+        where=r.c.watermark <= stmt.excluded.watermark,
+    )
+    db.execute(stmt)
@@ -0,0 +1,61 @@
+"""
+single_flight.py
+----------------
+Coalesce concurrent identical calls into one in-flight computation.
+✅ The first caller for a key runs the work; callers arriving meanwhile wait
+   and receive the same result (or the same exception)
+✅ Nothing is cached — once the call finishes, the next caller runs it again
+✅ Per process: each uvicorn worker coalesces its own requests
+"""
+
+import threading
+from metrics import coalesced_requests
+
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Keyed in-flight call registry. Keys must be hashable.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        """
+        Run fn() unless an identical call is already running, in which case
+        wait for it and return its result.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            coalesced_requests.inc(flight=self.name)
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
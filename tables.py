@@ -0,0 +1,231 @@
+"""
+tables.py
+---------
+Explicit Core definitions of the tables the report service reads.
+✅ No MetaData.reflect() at import — workers boot without a DB round-trip
+✅ Only the columns the service uses are declared
+✅ Indexes the hot queries rely on (created in production by migrations.py,
+   by metadata.create_all() in fixtures)
+✅ The service's own tables (batch shard leases, report store, refresh
+   queue, change queue, weekly aggregates, concept mastery), created by
+   migrations.py
+✅ SQLite fixtures get the change queue triggers with create_all(); on
+   Postgres they come from migrations.py
+"""
+
+from sqlalchemy import (
+    MetaData, Table, Column, BigInteger, Integer, String, Text, Float, Date, DateTime, Boolean, Index,
+    func, literal_column, event, inspect,
+)
+
+metadata = MetaData()
+
+students_table = Table(
+    "Users_student", metadata,
+    Column("id", BigInteger, primary_key=True),
+    Column("username", String),
+    Column("fullname", String),
+    Column("phone_number", String),
+    Column("class_name_id", BigInteger),
+    Column("section", String),
+)
+
+homework_table = Table(
+    "myapp_homeworksubmission", metadata,
+    Column("id", BigInteger, primary_key=True),
+    Column("student_id", String),          # varchar username
+    Column("student_name_id", BigInteger),  # FK → Users_student.id
+    Column("homework_id", Integer),
+    Column("submission_date", DateTime),
+    Column("agent_analysis_data", Text),
+    Column("result_json", Text),
+    Column("score", Float),
+    Column("percentage", Float),
+    Column("grade", String),
+)
+
+# ======================================================
+# ✅ SERVICE TABLES (keep in step with migrations.py)
+# ======================================================
+# One row per (batch run, shard): which weekly_batch.py node works on it
+batch_leases_table = Table(
+    "batch_shard_leases", metadata,
+    Column("run_id", String, primary_key=True),
+    Column("shard", Integer, primary_key=True),
+    Column("shard_count", Integer, nullable=False),
+    Column("status", String, nullable=False, default="pending"),  # pending | leased | done | failed
+    Column("owner", String),
+    Column("lease_expires_at", DateTime(timezone=True)),
+    Column("progress_phone", String),   # every parent up to this phone is finished
+    Column("attempts", Integer, nullable=False, default=0),
+    Column("updated_at", DateTime(timezone=True)),
+)
+
+# Pre-generated reports (report_store.py), one per student and report window
+report_store_table = Table(
+    "weekly_report_store", metadata,
+    Column("student_id", BigInteger, primary_key=True),
+    Column("report_window", String, primary_key=True),   # "latest:5" / "2025-10-20_2025-10-27:50"
+    Column("username", String),
+    Column("watermark", BigInteger, nullable=False),      # newest submission id covered
+    Column("content_marker", Text),                       # report_store._window_marker()
+    Column("mastery_marker", Text),                       # concept_mastery.mastery_marker() used
+    Column("report_version", String, nullable=False),     # PROMPT_VERSION:MODEL_NAME
+    Column("report", Text),                               # NULL: no usable homework
+    Column("generated_at", DateTime(timezone=True)),
+)
+
+# report_refresh.py: students with homework newer than their stored report
+refresh_dirty_table = Table(
+    "report_refresh_dirty", metadata,
+    Column("student_id", BigInteger, primary_key=True),
+    Column("first_dirty_at", DateTime(timezone=True), nullable=False),  # max-delay clock
+    Column("last_dirty_at", DateTime(timezone=True), nullable=False),   # debounce clock
+)
+
+# Id watermarks of the incremental consumers (report_refresh.py polling
+# fallback, weekly_aggregates.py consumers), one row per consumer
+refresh_state_table = Table(
+    "report_refresh_state", metadata,
+    Column("name", String, primary_key=True),
+    Column("last_submission_id", BigInteger, nullable=False),
+    Column("queue_changes", Boolean, nullable=False, default=False),  # fed by the change queue trigger
+)
+
+# Submissions inserted, updated or deleted since a consumer last read them:
+# the homework_submission_queue trigger adds one row per consumer with
+# queue_changes set
+submission_changes_table = Table(
+    "homework_submission_changes", metadata,
+    Column("consumer", String, primary_key=True),
+    Column("submission_id", BigInteger, primary_key=True),
+)
+
+
+def _weekly_counters():
+    return [
+        Column("submissions", Integer, nullable=False, default=0),
+        Column("unparsed", Integer, nullable=False, default=0),  # submissions without question detail
+        Column("questions", Integer, nullable=False, default=0),
+        Column("total_score", Float, nullable=False, default=0),
+        Column("max_score", Float, nullable=False, default=0),
+        Column("correct", Integer, nullable=False, default=0),
+        Column("partially_correct", Integer, nullable=False, default=0),
+        Column("incorrect", Integer, nullable=False, default=0),
+        Column("unattempted", Integer, nullable=False, default=0),
+        Column("other_answers", Integer, nullable=False, default=0),  # any other answer_category
+    ]
+
+
+# weekly_aggregates.py: homework totals per student and ISO week
+weekly_aggregates_table = Table(
+    "student_weekly_aggregates", metadata,
+    Column("student_id", BigInteger, primary_key=True),
+    Column("week_start", Date, primary_key=True),         # Monday of the ISO week
+    *_weekly_counters(),
+    Column("updated_at", DateTime(timezone=True)),
+)
+
+# weekly_aggregates.py: each submission's share of its week's totals, so an
+# updated or deleted submission can be taken back out
+weekly_aggregate_rows_table = Table(
+    "student_weekly_aggregate_rows", metadata,
+    Column("submission_id", BigInteger, primary_key=True),
+    Column("student_id", BigInteger, nullable=False),
+    Column("week_start", Date, nullable=False),
+    *_weekly_counters(),
+)
+
+# concept_mastery.py: per-student mastery of each concept_required entry
+concept_mastery_table = Table(
+    "student_concept_mastery", metadata,
+    Column("student_id", BigInteger, primary_key=True),
+    Column("concept", String, primary_key=True),
+    Column("attempts", Integer, nullable=False),       # questions that required it
+    Column("total_score", Float, nullable=False),
+    Column("max_score", Float, nullable=False),
+    Column("decayed_score", Float, nullable=False),    # as of last_seen
+    Column("decayed_max", Float, nullable=False),
+    Column("mastery", Float),                          # decayed percentage; NULL if no max score
+    Column("last_seen", DateTime, nullable=False),
+    Column("updated_at", DateTime(timezone=True)),
+)
+
+# concept_mastery.py: each submission's scores per concept, so an updated or
+# deleted submission can be taken back out of the index
+concept_observations_table = Table(
+    "student_concept_observations", metadata,
+    Column("submission_id", BigInteger, primary_key=True),
+    Column("concept", String, primary_key=True),
+    Column("student_id", BigInteger, nullable=False),
+    Column("seen", DateTime, nullable=False),          # submission date
+    Column("attempts", Integer, nullable=False),       # questions that required it
+    Column("total_score", Float, nullable=False),
+    Column("max_score", Float, nullable=False),
+)
+
+
+def phone_digits(column):
+    """
+    Digits-only phone number, e.g. "+91 75696-30144" → "917569630144".
+    Rendered with inline literals so Postgres matches ix_student_phone_digits.
+    """
+    return func.regexp_replace(
+        column, literal_column("'[^0-9]'"), literal_column("''"), literal_column("'g'")
+    )
+
+
+# ======================================================
+# ✅ INDEXES (keep in step with migrations.py)
+# ======================================================
+# Parent lookup by normalized phone (regexp_replace is Postgres-only)
+Index("ix_student_phone_digits", phone_digits(students_table.c.phone_number)).ddl_if(dialect="postgresql")
+
+# Bulk reports for a class / section
+Index("ix_student_class_section", students_table.c.class_name_id, students_table.c.section)
+
+# Latest-N fetch: equality on the student column, newest id first
+Index("ix_homework_student_name_id_id", homework_table.c.student_name_id, homework_table.c.id.desc())
+Index("ix_homework_student_id_id", homework_table.c.student_id, homework_table.c.id.desc())
+
+# Week-window fetch: equality on the student column, range on submission_date
+Index("ix_homework_student_name_date", homework_table.c.student_name_id, homework_table.c.submission_date)
+Index("ix_homework_student_id_date", homework_table.c.student_id, homework_table.c.submission_date)
+
+# Re-summing a week reads its submissions' shares
+Index("ix_weekly_aggregate_rows_student_week", weekly_aggregate_rows_table.c.student_id,
+      weekly_aggregate_rows_table.c.week_start)
+
+# Re-folding a concept reads its observations
+Index("ix_concept_observations_student_concept", concept_observations_table.c.student_id,
+      concept_observations_table.c.concept)
+
+
+# ======================================================
+# ✅ CHANGE QUEUE TRIGGERS (SQLite fixtures; keep in step with migrations.py)
+# ======================================================
+_QUEUE_CHANGE = (
+    "INSERT OR IGNORE INTO homework_submission_changes (consumer, submission_id) "
+    "SELECT name, {row}.id FROM report_refresh_state WHERE queue_changes"
+)
+_SQLITE_QUEUE_TRIGGERS = {
+    "insert": ("AFTER INSERT", "NEW"),
+    "update": ("AFTER UPDATE OF agent_analysis_data, result_json, submission_date, student_id, "
+               "student_name_id", "NEW"),
+    "delete": ("AFTER DELETE", "OLD"),
+}
+
+
+@event.listens_for(metadata, "after_create")
+def _create_sqlite_queue_triggers(target, connection, **kw):
+    if connection.dialect.name != "sqlite":
+        return
+    needed = {homework_table.name, refresh_state_table.name, submission_changes_table.name}
+    if not needed <= set(inspect(connection).get_table_names()):
+        return
+    for op, (event_clause, row) in _SQLITE_QUEUE_TRIGGERS.items():
+        connection.exec_driver_sql(
+            f"CREATE TRIGGER IF NOT EXISTS homework_submission_queue_{op} "
+            f"{event_clause} ON {homework_table.name} FOR EACH ROW "
+            f"BEGIN {_QUEUE_CHANGE.format(row=row)}; END"
+        )
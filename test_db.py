@@ -1,15 +1,7 @@
-from sqlalchemy import create_engine, text
-from dotenv import load_dotenv
-import os
+from sqlalchemy import text
 
-load_dotenv()
-
-DATABASE_URL = os.getenv("DATABASE_URL")
-if not DATABASE_URL:
-    raise RuntimeError("DATABASE_URL not set in .env")
-
-# Good defaults for managed Postgres (DigitalOcean)
-engine = create_engine(DATABASE_URL, pool_pre_ping=True, echo=False)
+# Shared engine with the tuned pool for managed Postgres (DigitalOcean)
+from database import engine
 
 def main():
     try:
@@ -0,0 +1,68 @@
+"""
+test_weekly_trend.py
+--------------------
+GET /weekly_trend/ against a scratch SQLite database.
+✅ Missing student_weekly_aggregates → 503 without the SQL error
+✅ With the table → the student's weeks
+
+Usage:
+    python -m pytest tests/
+"""
+
+import os
+import sys
+import tempfile
+from datetime import date
+
+# Scratch databases, set before the service modules read their config
+_tmp = tempfile.mkdtemp(prefix="weekly_trend_")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_tmp, 'service.sqlite3')}"
+os.environ["REPORT_JOBS_DB"] = os.path.join(_tmp, "report_jobs.sqlite3")
+os.environ["IDEMPOTENCY_DB"] = os.path.join(_tmp, "idempotency.sqlite3")
+os.environ["REPORT_CACHE_DB"] = os.path.join(_tmp, "report_cache.sqlite3")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from database import engine
+from tables import metadata, students_table, weekly_aggregates_table
+from weekly_aggregates import week_start
+
+
+@pytest.fixture
+def client():
+    metadata.drop_all(engine)
+    metadata.create_all(engine, tables=[students_table])
+    with engine.begin() as conn:
+        conn.execute(students_table.insert().values(id=1, username="a", phone_number="7569630144"))
+    yield TestClient(main.app)
+    metadata.drop_all(engine)
+
+
+def test_missing_aggregates_table_is_503_without_sql(client):
+    response = client.get("/weekly_trend/", params={"mobile_number": "7569630144"})
+
+    assert response.status_code == 503
+    assert response.json() == {"detail": "Weekly trend is not available yet."}
+    assert "student_weekly_aggregates" not in response.text
+
+
+def test_weeks_from_aggregates_table(client):
+    metadata.create_all(engine, tables=[weekly_aggregates_table])
+    week = week_start(date.today())
+    with engine.begin() as conn:
+        conn.execute(weekly_aggregates_table.insert().values(
+            student_id=1, week_start=week, submissions=2, unparsed=0, questions=4,
+            total_score=6, max_score=8, correct=3, partially_correct=0, incorrect=1,
+            unattempted=0, other_answers=0,
+        ))
+
+    response = client.get("/weekly_trend/", params={"mobile_number": "7569630144"})
+
+    assert response.status_code == 200
+    [entry] = response.json()["a"]
+    assert entry["week_start"] == week.isoformat()
+    assert entry["submissions"] == 2
+    assert entry["percentage"] == 75.0
@@ -0,0 +1,492 @@
+"""
+weekly_aggregates.py
+--------------------
+Per-student, per-ISO-week homework totals, maintained incrementally.
+✅ One small row per (student, ISO week): submissions, questions, earned /
+   max score and answer-category counts
+✅ `update` folds in every submission past a stored id watermark, in bounded
+   batches; a batch's totals and the watermark move commit together
+✅ Then it drains the change queue: submissions inserted, updated or deleted
+   since they were read (filled-in analysis, grading corrections, rows
+   committed late below the watermark) are taken back out of their week
+   and folded in again — each submission's share is kept per row, and the
+   touched weeks are re-summed from those rows
+✅ `backfill` rebuilds the table from the first submission in the same
+   bounded batches (an interrupted backfill is finished by `update`)
+✅ The same batches feed the concept mastery index (concept_mastery.py),
+   under its own watermark and change queue
+✅ Trend queries read these rows instead of re-parsing agent_analysis_data
+✅ Tables live in the service database (migrations.py / tables.py)
+
+Usage:
+    python weekly_aggregates.py update                    # e.g. cron, every 5 min
+    python weekly_aggregates.py backfill --batch-size 2000 --pause 0.2
+    python weekly_aggregates.py backfill --only concept_mastery
+    python weekly_aggregates.py show --mobile-number 7569630144 --weeks 8
+"""
+
+import argparse
+import logging
+import os
+import time
+from collections import namedtuple
+from datetime import date, datetime, timedelta, timezone
+from dotenv import load_dotenv
+from sqlalchemy import select, delete, update, func, and_, tuple_
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import DataError
+
+from database import engine, SessionLocal
+from tables import (
+    students_table, homework_table, weekly_aggregates_table, weekly_aggregate_rows_table,
+    concept_mastery_table, concept_observations_table, refresh_state_table, submission_changes_table,
+)
+from homework_data import _extracted_analysis, phone_filter
+from homework_decoder import decode_payload, Submission
+from report_stats import _number, _percent
+from concept_mastery import apply_concept_mastery, load_concept_mastery, MASTERY_CONSUMER
+
+load_dotenv()
+
+# ======================================================
+# ✅ AGGREGATE CONFIG
+# ======================================================
+WEEKLY_AGGREGATES_BATCH = int(os.getenv("WEEKLY_AGGREGATES_BATCH", "2000"))  # submissions per transaction
+
+_KEY_CHUNK = 500   # (student, week) pairs per re-sum statement
+
+COUNTERS = ("submissions", "unparsed", "questions", "total_score", "max_score",
+            "correct", "partially_correct", "incorrect", "unattempted", "other_answers")
+
+_CATEGORIES = {
+    "correct": "correct",
+    "partially-correct": "partially_correct",
+    "incorrect": "incorrect",
+    "wrong": "incorrect",
+    "unattempted": "unattempted",
+    "not-attempted": "unattempted",
+}
+
+
+def _insert(conn, table):
+    dialect = postgresql if conn.dialect.name == "postgresql" else sqlite
+    return dialect.insert(table)
+
+
+def week_start(value):
+    """
+    Monday of the ISO week of a date, datetime or ISO date string; None if
+    it can't be read.
+    """
+    if isinstance(value, str):
+        try:
+            value = date.fromisoformat(value[:10])
+        except ValueError:
+            return None
+    if isinstance(value, datetime):
+        value = value.date()
+    if not isinstance(value, date):
+        return None
+    return value - timedelta(days=value.isoweekday() - 1)
+
+
+def _category_column(category):
+    key = str(category or "").strip().lower().replace("_", "-").replace(" ", "-")
+    return _CATEGORIES.get(key, "other_answers")
+
+
+# ======================================================
+# ✅ READING SUBMISSIONS
+# ======================================================
+# One decoded submission, as handed to each consumer
+FoldedRow = namedtuple("FoldedRow", ["submission_id", "student_id", "submitted", "submission"])
+
+
+def _batch_query(ids, extract=False):
+    """
+    The given submissions, attributed to a student by FK or, for rows
+    without one, by username.
+    """
+    s, h = students_table, homework_table
+    return (
+        select(
+            h.c.id,
+            func.coalesce(h.c.student_name_id, s.c.id).label("student"),
+            h.c.submission_date,
+            _extracted_analysis(h) if extract else h.c.agent_analysis_data,
+            h.c.result_json,
+        )
+        .select_from(h.outerjoin(s, and_(h.c.student_name_id.is_(None), s.c.username == h.c.student_id)))
+        .where(h.c.id.in_(ids))
+        .order_by(h.c.id)
+    )
+
+
+def _fetch_batch(conn, ids):
+    if conn.dialect.name != "postgresql":
+        return conn.execute(_batch_query(ids)).all()
+    try:
+        with conn.begin_nested():
+            return conn.execute(_batch_query(ids, extract=True)).all()
+    except DataError:
+        logging.warning(f"Invalid analysis JSON in ids {ids[0]}..{ids[-1]}; fetching full payloads")
+        return conn.execute(_batch_query(ids)).all()
+
+
+def _submitted_at(value):
+    """
+    Naive UTC datetime of a submission_date column or payload string.
+    """
+    if isinstance(value, str):
+        try:
+            value = datetime.combine(date.fromisoformat(value[:10]), datetime.min.time())
+        except ValueError:
+            return None
+    if not isinstance(value, datetime):
+        return None
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def decode_rows(rows):
+    """
+    Decode a batch once for every consumer. The date comes from
+    submission_date, else from the payload; rows with no student or no
+    readable date are skipped.
+
+    Returns:
+        ([FoldedRow, ...], skipped) — submission is None for payloads
+        without question detail
+    """
+    folded = []
+    skipped = 0
+    for row in rows:
+        decoded = decode_payload(row.agent_analysis_data or row.result_json or "null")
+        submitted = row.submission_date
+        if submitted is None and isinstance(decoded, (Submission, dict)):
+            submitted = (decoded.submission_date if isinstance(decoded, Submission)
+                         else decoded.get("submission_date"))
+        submitted = _submitted_at(submitted)
+        if row.student is None or submitted is None:
+            skipped += 1
+            continue
+        folded.append(FoldedRow(
+            row.id, row.student, submitted, decoded if isinstance(decoded, Submission) else None
+        ))
+    return folded, skipped
+
+
+# ======================================================
+# ✅ WEEKLY TOTALS
+# ======================================================
+def submission_totals(row):
+    """
+    One decoded submission's share of its week: {counter: value}.
+    """
+    counts = dict.fromkeys(COUNTERS, 0)
+    counts["submissions"] = 1
+    if row.submission is None:
+        counts["unparsed"] = 1
+        return counts
+    for q in row.submission.questions:
+        counts["questions"] += 1
+        counts["total_score"] += _number(q.total_score)
+        counts["max_score"] += _number(q.max_score)
+        counts[_category_column(q.answer_category)] += 1
+    return counts
+
+
+def replace_weekly_totals(conn, ids, folded):
+    """
+    Swap the batch's per-submission rows for freshly decoded ones (a
+    submission that is gone or can't be attributed any more just loses its
+    row), then re-sum every week touched, before or after.
+    """
+    r = weekly_aggregate_rows_table
+    weeks = set(conn.execute(
+        delete(r).where(r.c.submission_id.in_(ids)).returning(r.c.student_id, r.c.week_start)
+    ).all())
+    rows = [
+        {"submission_id": row.submission_id, "student_id": row.student_id,
+         "week_start": week_start(row.submitted), **submission_totals(row)}
+        for row in folded
+    ]
+    if rows:
+        conn.execute(r.insert(), rows)
+    weeks.update((row["student_id"], row["week_start"]) for row in rows)
+    _resum_weeks(conn, list(weeks))
+
+
+def _resum_weeks(conn, weeks):
+    # Weeks left without submissions are dropped
+    r, a = weekly_aggregate_rows_table, weekly_aggregates_table
+    now = datetime.now(timezone.utc)
+    stmt = _insert(conn, a)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[a.c.student_id, a.c.week_start],
+        set_={column: stmt.excluded[column] for column in (*COUNTERS, "updated_at")},
+    )
+    for i in range(0, len(weeks), _KEY_CHUNK):
+        chunk = weeks[i:i + _KEY_CHUNK]
+        totals = conn.execute(
+            select(r.c.student_id, r.c.week_start, *(func.sum(r.c[column]).label(column) for column in COUNTERS))
+            .where(tuple_(r.c.student_id, r.c.week_start).in_(chunk))
+            .group_by(r.c.student_id, r.c.week_start)
+        ).mappings().all()
+        if totals:
+            conn.execute(stmt, [{**row, "updated_at": now} for row in totals])
+        found = {(row["student_id"], row["week_start"]) for row in totals}
+        empty = [week for week in chunk if week not in found]
+        if empty:
+            conn.execute(delete(a).where(tuple_(a.c.student_id, a.c.week_start).in_(empty)))
+
+
+# ======================================================
+# ✅ CONSUMERS AND WATERMARKS
+# ======================================================
+# Each consumer keeps its own id watermark and change queue, so one can be
+# backfilled (or added later) without touching the other. `rows` holds its
+# per-submission rows, which let it retract a changed submission;
+# apply(conn, ids, folded) gets every id of the batch, including ones that
+# no longer decode to a FoldedRow
+Consumer = namedtuple("Consumer", ["table", "rows", "apply", "label"])
+CONSUMERS = {
+    "weekly_aggregates": Consumer(
+        weekly_aggregates_table, weekly_aggregate_rows_table, replace_weekly_totals, "weekly totals"
+    ),
+    MASTERY_CONSUMER: Consumer(
+        concept_mastery_table, concept_observations_table, apply_concept_mastery, "concept mastery"
+    ),
+}
+
+
+def _lock_watermark(conn, name):
+    # FOR UPDATE serializes concurrent updaters of a consumer (a no-op on
+    # SQLite), so consumers may read-modify-write their rows
+    st = refresh_state_table
+    conn.execute(_insert(conn, st).values(name=name, last_submission_id=0).on_conflict_do_nothing())
+    return conn.execute(
+        select(st.c.last_submission_id).where(st.c.name == name).with_for_update()
+    ).scalar()
+
+
+def _enable_queue(name):
+    # Committed before the first batch reads anything, so a change landing
+    # while the batch runs is queued rather than lost
+    st = refresh_state_table
+    with engine.begin() as conn:
+        _lock_watermark(conn, name)
+        conn.execute(update(st).where(st.c.name == name, st.c.queue_changes.is_(False)).values(queue_changes=True))
+
+
+def _next_ids(conn, last_id, batch_size):
+    h = homework_table
+    return conn.execute(
+        select(h.c.id).where(h.c.id > last_id).order_by(h.c.id).limit(batch_size)
+    ).scalars().all()
+
+
+def _take_changes(conn, name, batch_size, ids=None):
+    """
+    Remove queued changes from the consumer's queue: those of `ids`, or
+    else the next `batch_size` queued ids. Done before the rows are read —
+    a change committed after this is queued again.
+    """
+    q = submission_changes_table
+    if ids:
+        conn.execute(delete(q).where(q.c.consumer == name, q.c.submission_id.in_(ids)))
+        return ids
+    queued = (
+        select(q.c.submission_id).where(q.c.consumer == name).order_by(q.c.submission_id).limit(batch_size)
+    )
+    return sorted(conn.execute(
+        delete(q).where(q.c.consumer == name, q.c.submission_id.in_(queued)).returning(q.c.submission_id)
+    ).scalars().all())
+
+
+def apply_batch(conn, name, batch_size=WEEKLY_AGGREGATES_BATCH):
+    """
+    Fold the next batch into a consumer's table, inside the caller's
+    transaction: submissions past its watermark (advancing it), or once it
+    has caught up, submissions from its change queue.
+
+    Returns:
+        (submissions read, submissions skipped, new watermark)
+    """
+    consumer = CONSUMERS[name]
+    last_id = upto = _lock_watermark(conn, name)
+    ids = _next_ids(conn, last_id, batch_size)
+    if ids:
+        upto = ids[-1]
+    ids = _take_changes(conn, name, batch_size, ids)
+    if not ids:
+        return 0, 0, last_id
+    folded, skipped = decode_rows(_fetch_batch(conn, ids))
+    consumer.apply(conn, ids, folded)
+    if upto != last_id:
+        st = refresh_state_table
+        conn.execute(update(st).where(st.c.name == name).values(last_submission_id=upto))
+    return len(ids), skipped, upto
+
+
+def update_consumer(name, batch_size=WEEKLY_AGGREGATES_BATCH, pause=0.0, verbose=False):
+    """
+    Apply batches until the consumer's watermark reaches the newest
+    submission. Each batch is its own transaction, so an interrupted run
+    keeps its progress.
+
+    Returns:
+        Number of submissions folded in
+    """
+    _enable_queue(name)
+    read_total = skipped_total = 0
+    while True:
+        with engine.begin() as conn:
+            read, skipped, upto = apply_batch(conn, name, batch_size)
+        if not read:
+            break
+        read_total += read
+        skipped_total += skipped
+        if verbose:
+            print(f"📦 {CONSUMERS[name].label}: {read_total} submissions folded in (watermark {upto})")
+        if pause:
+            time.sleep(pause)
+    if skipped_total:
+        print(f"⚠️ {CONSUMERS[name].label}: skipped {skipped_total} submission(s) without a student or date")
+    return read_total
+
+
+def backfill_consumer(name, batch_size=WEEKLY_AGGREGATES_BATCH, pause=0.0):
+    """
+    Rebuild a consumer's table from the first submission.
+    """
+    consumer = CONSUMERS[name]
+    with engine.begin() as conn:
+        _lock_watermark(conn, name)
+        conn.execute(delete(consumer.table))
+        conn.execute(delete(consumer.rows))
+        # everything queued so far is read again by the rebuild
+        q = submission_changes_table
+        conn.execute(delete(q).where(q.c.consumer == name))
+        st = refresh_state_table
+        conn.execute(update(st).where(st.c.name == name).values(last_submission_id=0))
+    print(f"🧹 {CONSUMERS[name].label} cleared — rebuilding from the first submission")
+    return update_consumer(name, batch_size, pause, verbose=True)
+
+
+# ======================================================
+# ✅ READING
+# ======================================================
+def load_weekly_aggregates(db, mobile_number, weeks=8, today=None):
+    """
+    The last `weeks` ISO weeks of every student on a phone, oldest first:
+    {username: [{"week_start": ..., counters..., "percentage": ...}]}.
+    Weeks without submissions are left out.
+    """
+    s, a = students_table, weekly_aggregates_table
+    postgres = db.get_bind().dialect.name == "postgresql"
+    since = week_start(today or date.today()) - timedelta(weeks=weeks - 1)
+    rows = db.execute(
+        select(s.c.username, a)
+        .join(a, a.c.student_id == s.c.id)
+        .where(phone_filter([mobile_number], normalized=postgres), a.c.week_start >= since)
+        .order_by(s.c.username, a.c.week_start)
+    ).mappings().all()
+
+    trend = {}
+    for row in rows:
+        week = {"week_start": row["week_start"].isoformat()}
+        week.update({column: row[column] for column in COUNTERS})
+        week["percentage"] = _percent(row["total_score"], row["max_score"])
+        trend.setdefault(row["username"], []).append(week)
+    return trend
+
+
+def status():
+    st = refresh_state_table
+    with engine.connect() as conn:
+        watermarks = dict(conn.execute(
+            select(st.c.name, st.c.last_submission_id).where(st.c.name.in_(list(CONSUMERS)))
+        ).all())
+        newest = conn.execute(select(func.max(homework_table.c.id))).scalar()
+        sizes = {
+            name: conn.execute(select(func.count(), func.count(c.table.c.student_id.distinct()))).one()
+            for name, c in CONSUMERS.items()
+        }
+        q = submission_changes_table
+        queued = dict(conn.execute(
+            select(q.c.consumer, func.count()).where(q.c.consumer.in_(list(CONSUMERS))).group_by(q.c.consumer)
+        ).all())
+    print(f"🔖 Newest submission: {newest}")
+    for name, consumer in CONSUMERS.items():
+        rows, students = sizes[name]
+        print(f"📊 {consumer.label}: watermark {watermarks.get(name)}, {rows} rows for {students} students, "
+              f"{queued.get(name, 0)} changed submission(s) queued")
+
+
+def show_phone(mobile_number, weeks):
+    s = students_table
+    db = SessionLocal()
+    try:
+        trend = load_weekly_aggregates(db, mobile_number, weeks)
+        postgres = db.get_bind().dialect.name == "postgresql"
+        students = db.execute(
+            select(s.c.id, s.c.username).where(phone_filter([mobile_number], normalized=postgres))
+        ).all()
+        mastery = load_concept_mastery(db, [student.id for student in students])
+    finally:
+        db.close()
+
+    for student in students:
+        print(f"👤 {student.username}")
+        for week in trend.get(student.username, []):
+            print(f"   {week['week_start']}: {week['submissions']} submissions, "
+                  f"{week['total_score']:g}/{week['max_score']:g} ({week['percentage']}%)")
+        concepts = mastery.get(student.id, {})
+        for label, key in (("💪", "strong_concepts"), ("🎯", "weak_concepts")):
+            for concept in concepts.get(key, []):
+                print(f"   {label} {concept['concept']}: {concept['percentage']}% "
+                      f"({concept['attempts']} attempts, last {concept['last_seen']})")
+
+
+# ======================================================
+# ✅ MAIN
+# ======================================================
+def main():
+    parser = argparse.ArgumentParser(description="Maintain per-student weekly aggregates and concept mastery.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    for name, help_text in (("update", "Fold in new and changed submissions"),
+                            ("backfill", "Rebuild the tables from all history")):
+        command = commands.add_parser(name, help=help_text)
+        command.add_argument("--only", choices=list(CONSUMERS),
+                             help="One table only (default: all)")
+        command.add_argument("--batch-size", type=int, default=WEEKLY_AGGREGATES_BATCH,
+                             help="Submissions per transaction")
+        command.add_argument("--pause", type=float, default=0.0,
+                             help="Seconds to sleep between batches (eases load on the primary)")
+    commands.add_parser("status", help="Show the watermarks and table sizes")
+    show = commands.add_parser("show", help="Print a parent's weekly totals and concept mastery")
+    show.add_argument("--mobile-number", required=True)
+    show.add_argument("--weeks", type=int, default=8)
+    args = parser.parse_args()
+
+    if args.command == "status":
+        status()
+    elif args.command == "show":
+        show_phone(args.mobile_number, args.weeks)
+    else:
+        names = [args.only] if args.only else list(CONSUMERS)
+        for name in names:
+            started = time.perf_counter()
+            if args.command == "backfill":
+                folded = backfill_consumer(name, args.batch_size, args.pause)
+                print(f"✅ {CONSUMERS[name].label}: backfilled {folded} submissions "
+                      f"in {time.perf_counter() - started:.1f}s")
+            else:
+                folded = update_consumer(name, args.batch_size, args.pause)
+                print(f"✅ {CONSUMERS[name].label}: folded in {folded} new or changed submissions")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,521 @@
+"""
+weekly_batch.py
+---------------
+The nightly cron job: weekly reports for every parent in Users_student.
+✅ Parent phones paged by keyset in short transactions — never all in
+   memory, no connection held for the run
+✅ Phones processed in chunks through the bulk path (one homework query per
+   chunk) by a worker pool; a bounded queue keeps memory flat
+✅ One file per parent, written atomically; a _summary.json per run
+✅ Stops taking new parents at the deadline so the run fits its window
+✅ Checkpointed (batch_checkpoint.py): rerunning the same week resumes —
+   finished parents are skipped, finished students are not regenerated
+✅ Failed parents are retried (BATCH_RETRY_PASSES) before a run or shard
+   ends; a shard that still has failures is marked failed, not done, and
+   the next run of the same command retries it
+✅ --distributed: any number of nodes split the run by leasing shards of
+   the parent list (batch_leases.py); a dead node's shards are taken over
+✅ --pregenerate: fills the report store (report_store.py) the endpoints
+   serve from; parents whose stored reports are still fresh cost nothing
+
+Usage:
+    python weekly_batch.py                                  # last 7 days
+    python weekly_batch.py --week-start 2025-10-20 --workers 8
+    python weekly_batch.py --latest --deadline-minutes 240  # latest 5 per student
+    python weekly_batch.py --restart                        # ignore checkpoints
+    python weekly_batch.py --distributed                    # on every node (Postgres)
+    python weekly_batch.py --latest --pregenerate           # warm the endpoints' store
+
+Cron (Sunday 01:00):
+    0 1 * * 0  cd /srv/CORN-JOB && python weekly_batch.py >> weekly_batch.log 2>&1
+"""
+
+import argparse
+import json
+import logging
+import os
+import queue
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import date
+from dotenv import load_dotenv
+from sqlalchemy import select
+
+from database import engine, SessionLocal
+from tables import students_table, phone_digits
+from batch_leases import ShardLeases, shard_of, shard_expr, BATCH_SHARDS
+from homework_data import week_window
+from report_pipeline import build_bulk_reports, format_txt_report
+from batch_checkpoint import CheckpointStore, write_atomic
+from report_store import load_stored, fresh_reports, save_reports
+
+load_dotenv()
+
+# ======================================================
+# ✅ BATCH CONFIG
+# ======================================================
+BATCH_OUTPUT_DIR = os.getenv("BATCH_OUTPUT_DIR", "weekly_reports")
+BATCH_WORKERS = int(os.getenv("BATCH_WORKERS", "4"))
+BATCH_CHUNK_SIZE = int(os.getenv("BATCH_CHUNK_SIZE", "25"))      # phones per homework query
+BATCH_FETCH_SIZE = int(os.getenv("BATCH_FETCH_SIZE", "1000"))    # phones per keyset page
+BATCH_DEADLINE_MINUTES = float(os.getenv("BATCH_DEADLINE_MINUTES", "360"))
+# Passes over the failed parents once the rest are done (quota / timeout
+# blips), the n-th after n × BATCH_RETRY_DELAY_SECONDS
+BATCH_RETRY_PASSES = int(os.getenv("BATCH_RETRY_PASSES", "2"))
+BATCH_RETRY_DELAY_SECONDS = float(os.getenv("BATCH_RETRY_DELAY_SECONDS", "10"))
+
+_STOP = object()
+
+
+# ======================================================
+# ✅ PARENT STREAM
+# ======================================================
+def iter_parent_phones(fetch_size=BATCH_FETCH_SIZE, shard=None, shard_count=None, after=None):
+    """
+    Yield every distinct parent phone in order, one keyset page of
+    fetch_size phones per short-lived connection — the run may take hours
+    and the workers block this generator, so nothing is held open between
+    pages. On Postgres phones are reduced to digits — the form the report
+    queries match on — so one parent with two spellings is reported once.
+    `shard` / `shard_count` keep one shard's phones (batch_leases.py);
+    `after` resumes past a phone already covered.
+    """
+    s = students_table
+    postgres = engine.dialect.name == "postgresql"
+    phone = phone_digits(s.c.phone_number) if postgres else s.c.phone_number
+
+    stmt = (
+        select(phone.label("phone"))
+        .where(s.c.phone_number.is_not(None), phone != "")
+        .distinct()
+        .order_by(phone)
+        .limit(fetch_size)
+    )
+    if shard is not None and postgres:
+        stmt = stmt.where(shard_expr(phone, shard_count) == shard)
+
+    while True:
+        page = stmt if after is None else stmt.where(phone > after)
+        with engine.connect() as conn:
+            phones = conn.execute(page).scalars().all()
+        for value in phones:
+            if shard is None or postgres or shard_of(value, shard_count) == shard:
+                yield value
+        if len(phones) < fetch_size:
+            return
+        # SQLite filters shards above, so advance past the last phone read
+        after = phones[-1]
+
+
+def _chunks(phones, size):
+    chunk = []
+    for phone in phones:
+        chunk.append(phone)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+# ======================================================
+# ✅ OUTPUT
+# ======================================================
+def output_path(output_dir, phone):
+    return os.path.join(output_dir, re.sub(r"[^0-9A-Za-z+_-]", "_", phone) + ".txt")
+
+
+# ======================================================
+# ✅ BATCH RUN
+# ======================================================
+class WeeklyBatch:
+    """
+    Producer (cursor over phones) → bounded chunk queue → worker threads.
+    Progress is checkpointed under `run_id`; runs sharing a run id resume
+    each other. run() covers every parent; run_distributed() covers the
+    shards this node manages to lease.
+    """
+
+    def __init__(self, output_dir, run_id, week=None, workers=BATCH_WORKERS,
+                 chunk_size=BATCH_CHUNK_SIZE, deadline_minutes=BATCH_DEADLINE_MINUTES,
+                 max_parents=None, checkpoints=None, pregenerate=False):
+        self.output_dir = output_dir
+        self.pregenerate = pregenerate
+        self.run_id = run_id
+        self.week = week
+        self.checkpoints = checkpoints or CheckpointStore()
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.deadline = time.monotonic() + deadline_minutes * 60
+        self.max_parents = max_parents
+        self.counts = Counter()
+        self.queued = 0
+        self._lock = threading.Lock()
+        self._queue = queue.Queue(maxsize=workers * 2)
+        self._threads = []
+        self._reset_progress()
+
+    # ---------- per-chunk work ----------
+    def _record_student(self, phone, username, report):
+        self.checkpoints.record_student(self.run_id, phone, username, report)
+
+    def _finish_parent(self, phone, result):
+        status = result["status"]
+        if status == "ok":
+            path = output_path(self.output_dir, phone)
+            write_atomic(path, format_txt_report(result["reports"]))
+            self.checkpoints.record_parent(self.run_id, phone, status, path)
+        elif status == "error":
+            # Not recorded: retried at the end of the pass, then by the next run
+            logging.error(f"Report failed for {phone}: {result['detail']}")
+            with self._lock:
+                self._failed.add(phone)
+            return
+        else:
+            self.checkpoints.record_parent(self.run_id, phone, status)
+        with self._lock:
+            self._failed.discard(phone)
+            self.counts[status] += 1
+
+    def _from_store(self, phones):
+        """
+        Pregenerate mode: finish parents whose stored reports are fresh.
+
+        Returns:
+            (phones still to generate, their StoredStudent rows)
+        """
+        db = SessionLocal()
+        try:
+            stored = load_stored(db, phones, self.week)
+        finally:
+            db.close()
+
+        pending = []
+        for phone in phones:
+            reports = fresh_reports(stored[phone])
+            if reports is None:
+                pending.append(phone)
+                continue
+            with self._lock:
+                self.counts["from_store"] += 1
+            self._finish_parent(phone, {"status": "ok", "reports": reports} if reports
+                                else {"status": "no_data"})
+        return pending, stored
+
+    def _save_to_store(self, results, stored):
+        db = SessionLocal()
+        try:
+            for phone, result in results.items():
+                if result["status"] in ("ok", "no_data"):
+                    save_reports(db, stored[phone], self.week, None, result.get("reports", {}))
+            db.commit()
+        except Exception:
+            logging.exception("Saving reports to the report store failed:")
+        finally:
+            db.close()
+
+    def _process(self, phones):
+        """
+        Generate one chunk. Returns the phones that failed.
+        """
+        finished = self.checkpoints.finished_parents(self.run_id, phones)
+        pending = [phone for phone in phones if phone not in finished]
+        with self._lock:
+            self.counts["resumed"] += len(finished)
+        if pending and self.pregenerate:
+            pending, stored = self._from_store(pending)
+        if not pending:
+            return []
+
+        try:
+            results = build_bulk_reports(
+                mobile_numbers=pending, week=self.week,
+                completed=self.checkpoints.student_reports(self.run_id, pending),
+                on_report=self._record_student,
+            )
+        except Exception as e:
+            logging.exception(f"Chunk of {len(pending)} phones failed:")
+            results = {phone: {"status": "error", "detail": str(e)} for phone in pending}
+
+        if self.pregenerate:
+            self._save_to_store(results, stored)
+        for phone, result in results.items():
+            self._finish_parent(phone, result)
+        return [phone for phone, result in results.items() if result["status"] == "error"]
+
+    # ---------- progress watermark ----------
+    def _reset_progress(self):
+        # A chunk with failed parents never counts as done, so the
+        # watermark (and a shard's saved progress) stops in front of it
+        self.progress_phone = None  # every chunk up to this phone is done
+        self._failed = set()
+        self._chunk_last = {}
+        self._chunks_done = set()
+        self._next_seq = 0
+        self._done_through = -1
+
+    def _chunk_done(self, seq):
+        with self._lock:
+            self._chunks_done.add(seq)
+            while self._done_through + 1 in self._chunks_done:
+                self._done_through += 1
+                self._chunks_done.discard(self._done_through)
+                self.progress_phone = self._chunk_last.pop(self._done_through)
+
+    # ---------- workers ----------
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is _STOP:
+                    return
+                seq, chunk = item
+                failed = self._process(chunk)
+                if seq is not None and not failed:
+                    self._chunk_done(seq)
+            finally:
+                self._queue.task_done()
+
+    def _start_workers(self):
+        os.makedirs(self.output_dir, exist_ok=True)
+        self._threads = [
+            threading.Thread(target=self._work, name=f"weekly-batch-{i}", daemon=True)
+            for i in range(self.workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def _stop_workers(self):
+        for _ in self._threads:
+            self._queue.put(_STOP)
+        for thread in self._threads:
+            thread.join()
+
+    def _out_of_time(self):
+        return time.monotonic() > self.deadline or (
+            self.max_parents is not None and self.queued >= self.max_parents
+        )
+
+    def _feed(self, shard=None, shard_count=None, after=None, stop=None):
+        """
+        Queue the phones (of one shard, past `after`) and wait until the
+        workers have finished them.
+
+        Failed parents are retried once the rest are done; any still failing
+        are left in self._failed and counted as "error".
+
+        Returns:
+            True if every phone was covered, False if stopped early
+        """
+        self._reset_progress()
+        complete = True
+        phones = iter_parent_phones(shard=shard, shard_count=shard_count, after=after)
+        for chunk in _chunks(phones, self.chunk_size):
+            if self._out_of_time() or (stop is not None and stop.is_set()):
+                complete = False
+                break
+            if self.max_parents is not None:
+                chunk = chunk[:self.max_parents - self.queued]
+            with self._lock:
+                seq = self._next_seq
+                self._next_seq += 1
+                self._chunk_last[seq] = chunk[-1]
+            self._queue.put((seq, chunk))  # blocks while workers are busy
+            self.queued += len(chunk)
+            if self.queued % (self.chunk_size * 20) < self.chunk_size:
+                print(f"📤 {self.queued} parents queued, {dict(self.counts)}")
+        self._queue.join()
+
+        for attempt in range(1, BATCH_RETRY_PASSES + 1):
+            with self._lock:
+                failed = sorted(self._failed)
+            if not failed:
+                break
+            print(f"🔁 Retrying {len(failed)} failed parent(s), pass {attempt}/{BATCH_RETRY_PASSES}")
+            delay = attempt * BATCH_RETRY_DELAY_SECONDS
+            if (stop or threading.Event()).wait(delay) or time.monotonic() > self.deadline:
+                break
+            for chunk in _chunks(failed, self.chunk_size):
+                self._queue.put((None, chunk))  # retries don't move the watermark
+            self._queue.join()
+
+        with self._lock:
+            if self._failed:
+                self.counts["error"] += len(self._failed)
+        return complete
+
+    def _summary(self, started, stopped_early, name="_summary.json", **extra):
+        summary = {
+            "run_id": self.run_id,
+            "week": [bound.isoformat() for bound in self.week] if self.week else None,
+            "parents_queued": self.queued,
+            "results": dict(self.counts),
+            "stopped_at_deadline": stopped_early,
+            "elapsed_seconds": round(time.monotonic() - started, 1),
+            **extra,
+        }
+        write_atomic(os.path.join(self.output_dir, name), json.dumps(summary, indent=2))
+        return summary
+
+    # ---------- runs ----------
+    def run(self):
+        started = time.monotonic()
+        self._start_workers()
+        try:
+            complete = self._feed()
+        finally:
+            self._stop_workers()
+        if not complete:
+            print("⏰ Deadline reached — not starting more parents")
+        return self._summary(started, not complete)
+
+    def _heartbeat(self, leases, shard, stop, lost):
+        while not stop.wait(leases.lease_seconds / 3):
+            try:
+                if not leases.heartbeat(shard, self.progress_phone):
+                    print(f"⚠️ Lost the lease on shard {shard} — leaving it to its new owner")
+                    lost.set()
+                    stop.set()
+                    return
+            except Exception:
+                logging.exception(f"Heartbeat for shard {shard} failed:")
+
+    def run_distributed(self, leases):
+        """
+        Lease shards until every shard of the run is done (or the deadline).
+        While other nodes hold the last shards, keep polling so a shard
+        whose owner died is taken over when its lease expires.
+        """
+        started = time.monotonic()
+        leases.ensure()
+        shards_done = []
+        stopped_early = False
+        self._start_workers()
+        try:
+            while True:
+                if self._out_of_time():
+                    stopped_early = True
+                    break
+                claimed = leases.claim()
+                if claimed is None:
+                    if not leases.counts().get("leased"):
+                        break  # nothing pending, nobody working: run finished
+                    time.sleep(min(leases.lease_seconds / 2, 10))
+                    continue
+
+                shard, after = claimed
+                print(f"🔒 Shard {shard}/{leases.shard_count}" + (f" from {after}" if after else ""))
+                stop, lost = threading.Event(), threading.Event()
+                beat = threading.Thread(target=self._heartbeat, args=(leases, shard, stop, lost), daemon=True)
+                beat.start()
+                try:
+                    complete = self._feed(shard, leases.shard_count, after, stop)
+                finally:
+                    stop.set()
+                    beat.join()
+
+                if lost.is_set():
+                    continue
+                if not complete:
+                    leases.release(shard, self.progress_phone)
+                elif self._failed:
+                    # Parked until the next run, so one bad parent can't
+                    # keep this or another node busy with the shard
+                    print(f"⚠️ Shard {shard}: {len(self._failed)} parent(s) still failing — marked failed")
+                    leases.fail(shard, self.progress_phone)
+                else:
+                    leases.complete(shard)
+                    shards_done.append(shard)
+        finally:
+            self._stop_workers()
+
+        if stopped_early:
+            print("⏰ Deadline reached — not starting more parents")
+        safe_owner = re.sub(r"[^0-9A-Za-z_-]", "_", leases.owner)
+        return self._summary(started, stopped_early, name=f"_summary_{safe_owner}.json",
+                             owner=leases.owner, shards=shards_done)
+
+
+# ======================================================
+# ✅ MAIN
+# ======================================================
+def main():
+    parser = argparse.ArgumentParser(description="Generate weekly reports for every parent.")
+    parser.add_argument("--week-start", type=date.fromisoformat,
+                        help="Window start (default: 7 days before --week-end)")
+    parser.add_argument("--week-end", type=date.fromisoformat,
+                        help="Window end, exclusive (default: today)")
+    parser.add_argument("--latest", action="store_true",
+                        help="Latest 5 submissions per student instead of a date window")
+    parser.add_argument("--output-dir", default=BATCH_OUTPUT_DIR)
+    parser.add_argument("--workers", type=int, default=BATCH_WORKERS)
+    parser.add_argument("--chunk-size", type=int, default=BATCH_CHUNK_SIZE)
+    parser.add_argument("--deadline-minutes", type=float, default=BATCH_DEADLINE_MINUTES)
+    parser.add_argument("--max-parents", type=int, help="Stop after this many parents (trial runs)")
+    parser.add_argument("--run-id", help="Checkpoint key (default: the week, or latest_<today>)")
+    parser.add_argument("--restart", action="store_true",
+                        help="Discard this run's checkpoints and regenerate everything")
+    parser.add_argument("--distributed", action="store_true",
+                        help="Share the run with other nodes through Postgres shard leases")
+    parser.add_argument("--shards", type=int, default=BATCH_SHARDS,
+                        help="Shards per distributed run (same on every node)")
+    parser.add_argument("--owner", help="Node name in the lease table (default: host:pid)")
+    parser.add_argument("--pregenerate", action="store_true",
+                        help="Also fill the report store the endpoints serve from")
+    args = parser.parse_args()
+
+    if args.distributed and engine.dialect.name != "postgresql":
+        sys.exit(f"❌ --distributed needs Postgres, not {engine.dialect.name}")
+    if args.distributed and args.restart:
+        sys.exit("❌ --restart is per node; start a distributed rerun with a new --run-id")
+
+    if args.latest:
+        week = None
+        run_id = f"latest_{date.today().isoformat()}"
+        run_dir = os.path.join(args.output_dir, run_id)
+    else:
+        week_end = args.week_end or (None if args.week_start else date.today())
+        try:
+            week = week_window(args.week_start, week_end)
+        except ValueError as e:
+            sys.exit(f"❌ {e}")
+        run_id = f"{week[0].date().isoformat()}_{week[1].date().isoformat()}"
+        run_dir = os.path.join(args.output_dir, week[0].date().isoformat())
+    run_id = args.run_id or run_id
+
+    checkpoints = CheckpointStore()
+    checkpoints.prune()
+    if args.restart:
+        checkpoints.clear(run_id)
+
+    print("📘 SmartLearners.ai – Weekly Batch\n")
+    print(f"🗂️  Run {run_id}: writing to {run_dir} with {args.workers} workers × {args.chunk_size} phones")
+    done = checkpoints.counts(run_id)
+    if done:
+        print(f"♻️  Resuming: {sum(done.values())} parents already finished {dict(done)}")
+
+    batch = WeeklyBatch(
+        run_dir, run_id, week=week, workers=args.workers, chunk_size=args.chunk_size,
+        deadline_minutes=args.deadline_minutes, max_parents=args.max_parents,
+        checkpoints=checkpoints, pregenerate=args.pregenerate,
+    )
+    if args.distributed:
+        leases = ShardLeases(engine, run_id, args.shards, owner=args.owner)
+        try:
+            summary = batch.run_distributed(leases)
+        except ValueError as e:
+            sys.exit(f"❌ {e}")
+        print(f"\n🔓 Shards this node finished: {summary['shards']}, run: {leases.counts()}")
+    else:
+        summary = batch.run()
+
+    print(f"\n✅ Batch finished in {summary['elapsed_seconds']}s: {summary['results']}")
+    if summary["stopped_at_deadline"] or summary["results"].get("error"):
+        print("⚠️ Unfinished parents remain — rerun the same command to resume")
+
+
+if __name__ == "__main__":
+    main()